@@ -12,7 +12,7 @@ rtklib.
 
 import sys, time
 import bitstring as bs
-import satPosition, util, RTCMv2, positionEstimate
+import satPosition, util, RTCMv2, positionEstimate, ephemeris
 
 from bitstring import BitStream
 
@@ -40,6 +40,7 @@ corr_set = {}
 statid = 0 #initially only support 1 reference station
 
 eph = {}
+eph_table = ephemeris.EphemerisTable()
 prs = {}
 week = 0
 itow = 0
@@ -290,43 +291,41 @@ def decode_1019(pkt):
     eph[svid].af0 = af0         * pow(2, -31)
     eph[svid].af1 = af1         * pow(2, -43)
     eph[svid].af2 = af2         * pow(2, -55)
+    eph[svid].svid = svid
+    eph[svid].week = week
+    eph[svid].fit_flag = fit
+    eph_table.add(svid, iode, eph[svid])
 
 
 def regen_v2_type1():
+    import numpy
 
     if ref_pos is None:
         return
 
     errset = {}
     pranges = {}
-    for svid in prs:
 
-        if svid not in eph:
-            #print("Don't have ephemeris for {}, only {}".format(svid, eph.keys()))
-            continue
-
-        toc = eph[svid].toc
-        tof = prs[svid] / util.speedOfLight
+    # we need ephemeris data for the space vehicle
+    svids = [svid for svid in prs if svid in eph]
+    tof = numpy.array([prs[svid] for svid in svids]) / util.speedOfLight
 
-        # assume the time_of_week is the exact receiver time of week that the message arrived.
-        # subtract the time of flight to get the satellite transmit time
-        transmitTime = itow - tof
-    
-        T = util.correctWeeklyTime(transmitTime - toc)
+    # assume the time_of_week is the exact receiver time of week that the message arrived.
+    # subtract the time of flight to get the satellite transmit time
+    transmitTime = itow - tof
 
-        satpos = satPosition.satPosition_raw(eph[svid], svid, transmitTime)
-        Trel = satpos.extra
+    ephs = eph_table.select(eph_table.lookup(svids))
+    satpos, Trel, dTclck = satPosition.satPositions(ephs, transmitTime, svids)
+    satpos = satPosition.correctPositions(satpos, tof)
 
-        satPosition.correctPosition_raw(satpos, tof)
-
-        geo = satpos.distance(util.PosVector(*ref_pos))
-    
-        dTclck = eph[svid].af0 + eph[svid].af1 * T + eph[svid].af2 * T * T + Trel - eph[svid].Tgd
+    geo = numpy.sqrt(((satpos - numpy.array(ref_pos))**2).sum(axis=1))
+    dTclck -= ephs['Tgd']
 
+    for i, svid in enumerate(svids):
         # Incoming PR is already corrected for receiver clock bias
-        prAdjusted = prs[svid] + dTclck * util.speedOfLight
+        prAdjusted = prs[svid] + float(dTclck[i]) * util.speedOfLight
 
-        errset[svid] = geo - prAdjusted
+        errset[svid] = float(geo[i]) - prAdjusted
         pranges[svid] = prAdjusted
 
     save_satlog(itow, errset)
@@ -42,10 +42,11 @@ elif opts.ecef_reference is not None:
 else:
     reference_position = None
 
-def setup_port(port, log, append=False):
+def setup_port(port, log, append=False, configure=None):
     dev = ublox.UBlox(port, baudrate=opts.baudrate, timeout=0.01)
     dev.set_logfile(log, append=append)
     dev.set_binary()
+    dev.begin_config()
     dev.configure_poll_port()
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_USB)
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_NAVX5)
@@ -59,20 +60,46 @@ def setup_port(port, log, append=False):
     dev.configure_poll_port(ublox.PORT_SERIAL1)
     dev.configure_poll_port(ublox.PORT_SERIAL2)
     dev.configure_poll_port(ublox.PORT_USB)
+    if configure is not None:
+        configure(dev)
+    dev.end_config(ublox.show_config_failures)
     return dev
 
+def configure_dev2(dev):
+    '''message rates for the corrected rover'''
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_DGPS, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELECEF, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELNED, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SOL, 1)
+    dev.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SVSI, 0)
+    dev.configure_solution_rate(rate_ms=1000)
+
+def configure_dev3(dev):
+    '''message rates for the uncorrected rover'''
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELECEF, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELNED, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SOL, 1)
+    dev.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SVSI, 0)
+    dev.configure_solution_rate(rate_ms=1000)
+
 if opts.nmea_2:
     dev2 = nmea_wrapper.NMEAModule(opts.port2, opts.baudrate)
     dev2.set_logfile(opts.log2)
 else:
-    dev2 = setup_port(opts.port2, opts.log2)
+    dev2 = setup_port(opts.port2, opts.log2, configure=configure_dev2)
 
 if opts.port3 is not None:
     if opts.nmea_3:
         dev3 = nmea_wrapper.NMEAModule(opts.port3, opts.baudrate)
         dev3.set_logfile(opts.log3)
     else:
-        dev3 = setup_port(opts.port3, opts.log3)
+        dev3 = setup_port(opts.port3, opts.log3, configure=configure_dev3)
 else:
     dev3 = None
 
@@ -99,38 +126,17 @@ if opts.module_reset:
     if opts.nmea_2:
         dev2 = None
     else:
-        dev2 = setup_port(opts.port2, opts.log2)
+        dev2 = setup_port(opts.port2, opts.log2, configure=configure_dev2)
 
     if opts.port3 is not None:
         if opts.nmea_3:
             dev3 = None
         else:
-            dev3 = setup_port(opts.port3, opts.log3)
+            dev3 = setup_port(opts.port3, opts.log3, configure=configure_dev3)
     else:
         dev3 = None
 
 
-if not opts.nmea_2:
-    dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
-    dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
-    dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_DGPS, 1)
-    dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 1)
-    dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELECEF, 0)
-    dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELNED, 0)
-    dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SOL, 1)
-    dev2.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SVSI, 0)
-    dev2.configure_solution_rate(rate_ms=1000)
-
-if dev3 is not None and not opts.nmea_3:
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 0)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELECEF, 0)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELNED, 0)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SOL, 1)
-    dev3.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SVSI, 0)
-    dev3.configure_solution_rate(rate_ms=1000)
-
 # we want the ground station to use a stationary model, and the roving
 # GPS to use a highly dynamic model
 if not opts.nmea_2:
@@ -150,7 +156,7 @@ def handle_device2(msg):
     global rx2_pos
     '''handle message from rover GPS'''
     if msg.name() == 'NAV_DGPS':
-        msg.unpack()
+        msg.unpack(lazy=True)
         print("DGPS: age=%u numCh=%u" % (msg.age, msg.numCh))
     if msg.name() == "NAV_POSECEF":
         msg.unpack()
@@ -197,13 +203,13 @@ while True:
 
     if opts.reopen and time.time() > last_msg2_time + 5:
         dev2.close()
-        dev2 = setup_port(opts.port2, opts.log2, append=True)
+        dev2 = setup_port(opts.port2, opts.log2, append=True, configure=configure_dev2)
         last_msg2_time = time.time()
         sys.stdout.write('R2')
 
     if dev3 is not None and opts.reopen and time.time() > last_msg3_time + 5:
         dev3.close()
-        dev3 = setup_port(opts.port3, opts.log3, append=True)
+        dev3 = setup_port(opts.port3, opts.log3, append=True, configure=configure_dev3)
         last_msg3_time = time.time()
         sys.stdout.write('R3')
 
@@ -34,10 +34,11 @@ parser.add_option("--module-reset", action='store_true', help="cold start all th
 
 (opts, args) = parser.parse_args()
 
-def setup_port(port, log, append=False):
+def setup_port(port, log, append=False, configure=None):
     dev = ublox.UBlox(port, baudrate=opts.baudrate, timeout=0.01)
     dev.set_logfile(log, append=append)
     dev.set_binary()
+    dev.begin_config()
     dev.configure_poll_port()
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_USB)
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_NAVX5)
@@ -51,13 +52,49 @@ def setup_port(port, log, append=False):
     dev.configure_poll_port(ublox.PORT_SERIAL1)
     dev.configure_poll_port(ublox.PORT_SERIAL2)
     dev.configure_poll_port(ublox.PORT_USB)
+    if configure is not None:
+        configure(dev)
+    dev.end_config(ublox.show_config_failures)
     return dev
 
-dev1 = setup_port(opts.port1, opts.log1, append=opts.append)
-dev2 = setup_port(opts.port2, opts.log2, append=opts.append)
+def configure_dev1(dev):
+    '''message rates for the reference receiver'''
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
+    dev.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_RAW, 1)
+    dev.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SFRB, 1)
+    dev.configure_message_rate(ublox.CLASS_AID, ublox.MSG_AID_EPH, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 1)
+    dev.configure_solution_rate(rate_ms=200)
+
+def configure_dev2(dev):
+    '''message rates for the corrected rover'''
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_DGPS, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELECEF, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELNED, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SOL, 1)
+    dev.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SVSI, 0)
+    dev.configure_solution_rate(rate_ms=1000)
+
+def configure_dev3(dev):
+    '''message rates for the uncorrected rover'''
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELECEF, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELNED, 0)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SOL, 1)
+    dev.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SVSI, 0)
+    dev.configure_solution_rate(rate_ms=1000)
+
+dev1 = setup_port(opts.port1, opts.log1, append=opts.append, configure=configure_dev1)
+dev2 = setup_port(opts.port2, opts.log2, append=opts.append, configure=configure_dev2)
 
 if opts.port3 is not None:
-    dev3 = setup_port(opts.port3, opts.log3, append=opts.append)
+    dev3 = setup_port(opts.port3, opts.log3, append=opts.append, configure=configure_dev3)
 else:
     dev3 = None
 
@@ -76,43 +113,13 @@ if opts.module_reset:
 
     time.sleep(1)
 
-    dev2 = setup_port(opts.port2, opts.log2)
+    dev2 = setup_port(opts.port2, opts.log2, configure=configure_dev2)
 
     if opts.port3 is not None:
-        dev3 = setup_port(opts.port3, opts.log3)
+        dev3 = setup_port(opts.port3, opts.log3, configure=configure_dev3)
     else:
         dev3 = None
 
-
-dev1.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
-dev1.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
-dev1.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_RAW, 1)
-dev1.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SFRB, 1)
-dev1.configure_message_rate(ublox.CLASS_AID, ublox.MSG_AID_EPH, 1)
-dev1.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 1)
-dev1.configure_solution_rate(rate_ms=200)
-
-
-dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
-dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
-dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_DGPS, 1)
-dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 1)
-dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELECEF, 0)
-dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELNED, 0)
-dev2.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SOL, 1)
-dev2.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SVSI, 0)
-dev2.configure_solution_rate(rate_ms=1000)
-
-if dev3 is not None:
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 0)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELECEF, 0)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_VELNED, 0)
-    dev3.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SOL, 1)
-    dev3.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SVSI, 0)
-    dev3.configure_solution_rate(rate_ms=1000)
-
 # we want the ground station to use a stationary model, and the roving
 # GPS to use a highly dynamic model
 dev1.set_preferred_dynamic_model(opts.dynmodel1)
@@ -212,20 +219,25 @@ else:
 satinfo.min_elevation = opts.minelevation
 satinfo.min_quality = opts.minquality
 
+def save_message(msg):
+    '''keep the latest message of each type from the reference GPS'''
+    messages[msg.name()] = msg
+    satinfo.add_message(msg)
+
+def handle_device1_raw(msg):
+    handle_rxm_raw(msg)
+    position_estimate(messages, satinfo)
+
+device1 = ublox.UBloxDispatcher()
+device1.subscribe(['RXM_RAW', 'NAV_POSECEF', 'RXM_SFRB', 'AID_EPH'], save_message)
+device1.subscribe('RXM_RAW', handle_device1_raw)
+
 def handle_device1(msg):
     '''handle message from reference GPS'''
-    global messages, satinfo
-    
-    if msg.name() in [ 'RXM_RAW', 'NAV_POSECEF', 'RXM_SFRB', 'RXM_RAW', 'AID_EPH', 'NAV_POSECEF' ]:
-        try:
-            msg.unpack()
-            messages[msg.name()] = msg
-            satinfo.add_message(msg)
-        except ublox.UBloxError as e:
-            print(e)
-    if msg.name() == 'RXM_RAW':
-        handle_rxm_raw(msg)
-        position_estimate(messages, satinfo)
+    try:
+        device1.dispatch(msg)
+    except ublox.UBloxError as e:
+        print(e)
 
 if opts.append:
     errlog = open(time.strftime('errlog-%y%m%d-%H%M.txt'), mode='a')
@@ -238,90 +250,113 @@ def display_diff(name, pos1, pos2):
 
 pos_count = 0
 
-def handle_device2(msg):
-    '''handle message from rover GPS'''
+def handle_device2_dgps(msg):
+    print("DGPS: age=%u numCh=%u pos_count=%u" % (msg.age, msg.numCh, pos_count))
+
+def handle_device2_pos(msg):
     global pos_count
-    if msg.name() == 'NAV_DGPS':
-        msg.unpack()
-        print("DGPS: age=%u numCh=%u pos_count=%u" % (msg.age, msg.numCh, pos_count))
-    if msg.name() == "NAV_POSECEF":
-        msg.unpack()
-        pos = util.PosVector(msg.ecefX*0.01, msg.ecefY*0.01, msg.ecefZ*0.01)
-        satinfo.recv2_position = pos
-        if satinfo.average_position is None or satinfo.position_estimate is None:
-            return
-        print("-----------------")
-        display_diff("RECV1<->RECV2", satinfo.receiver_position, pos)
-        display_diff("RECV2<->AVG",   satinfo.receiver_position, satinfo.average_position)
-        display_diff("AVG<->RECV1",   satinfo.average_position, satinfo.receiver_position)
-        display_diff("AVG<->RECV2",   satinfo.average_position, pos)
-        if satinfo.reference_position is not None:
-            display_diff("REF<->AVG",   satinfo.reference_position, satinfo.average_position)
-            display_diff("POS<->REF",   satinfo.position_estimate, satinfo.reference_position)
-            if satinfo.rtcm_position is not None:
-                display_diff("RTCM<->REF", satinfo.rtcm_position, satinfo.reference_position)                
-                display_diff("RTCM<->RECV2", satinfo.rtcm_position, satinfo.recv2_position)                
-            display_diff("RECV1<->REF", satinfo.receiver_position, satinfo.reference_position)
-            display_diff("RECV2<->REF", satinfo.recv2_position, satinfo.reference_position)
-            pos_count += 1
-            if satinfo.recv3_position is not None:
-                display_diff("RECV3<->REF", satinfo.recv3_position, satinfo.reference_position)
-                errlog.write("%f %f %f %f\n" % (
-                    satinfo.reference_position.distance(satinfo.recv3_position),
-                    satinfo.reference_position.distance(satinfo.recv2_position),
-                    satinfo.reference_position.distanceXY(satinfo.recv3_position),
-                    satinfo.reference_position.distanceXY(satinfo.recv2_position)))
-                errlog.flush()
-            else:
-                errlog.write("%f %f %f %f\n" % (
-                    satinfo.reference_position.distance(satinfo.receiver_position),
-                    satinfo.reference_position.distance(satinfo.recv2_position),
-                    satinfo.reference_position.distanceXY(satinfo.receiver_position),
-                    satinfo.reference_position.distanceXY(satinfo.recv2_position)))
-                errlog.flush()
+    pos = util.PosVector(msg.ecefX*0.01, msg.ecefY*0.01, msg.ecefZ*0.01)
+    satinfo.recv2_position = pos
+    if satinfo.average_position is None or satinfo.position_estimate is None:
+        return
+    print("-----------------")
+    display_diff("RECV1<->RECV2", satinfo.receiver_position, pos)
+    display_diff("RECV2<->AVG",   satinfo.receiver_position, satinfo.average_position)
+    display_diff("AVG<->RECV1",   satinfo.average_position, satinfo.receiver_position)
+    display_diff("AVG<->RECV2",   satinfo.average_position, pos)
+    if satinfo.reference_position is not None:
+        display_diff("REF<->AVG",   satinfo.reference_position, satinfo.average_position)
+        display_diff("POS<->REF",   satinfo.position_estimate, satinfo.reference_position)
+        if satinfo.rtcm_position is not None:
+            display_diff("RTCM<->REF", satinfo.rtcm_position, satinfo.reference_position)                
+            display_diff("RTCM<->RECV2", satinfo.rtcm_position, satinfo.recv2_position)                
+        display_diff("RECV1<->REF", satinfo.receiver_position, satinfo.reference_position)
+        display_diff("RECV2<->REF", satinfo.recv2_position, satinfo.reference_position)
+        pos_count += 1
+        if satinfo.recv3_position is not None:
+            display_diff("RECV3<->REF", satinfo.recv3_position, satinfo.reference_position)
+            errlog.write("%f %f %f %f\n" % (
+                satinfo.reference_position.distance(satinfo.recv3_position),
+                satinfo.reference_position.distance(satinfo.recv2_position),
+                satinfo.reference_position.distanceXY(satinfo.recv3_position),
+                satinfo.reference_position.distanceXY(satinfo.recv2_position)))
+            errlog.flush()
+        else:
+            errlog.write("%f %f %f %f\n" % (
+                satinfo.reference_position.distance(satinfo.receiver_position),
+                satinfo.reference_position.distance(satinfo.recv2_position),
+                satinfo.reference_position.distanceXY(satinfo.receiver_position),
+                satinfo.reference_position.distanceXY(satinfo.recv2_position)))
+            errlog.flush()
+
+device2 = ublox.UBloxDispatcher()
+device2.subscribe('NAV_DGPS', handle_device2_dgps, unpack=ublox.UBloxDispatcher.UNPACK_LAZY)
+device2.subscribe('NAV_POSECEF', handle_device2_pos)
 
-def handle_device3(msg):
-    '''handle message from uncorrected rover GPS'''
-    if msg.name() == "NAV_POSECEF":
-        msg.unpack()
-        pos = util.PosVector(msg.ecefX*0.01, msg.ecefY*0.01, msg.ecefZ*0.01)
-        satinfo.recv3_position = pos
-                                            
-
-while True:
-    # get a message from the reference GPS
-    msg = dev1.receive_message_noerror()
-    if msg is not None:
-        handle_device1(msg)
-        last_msg1_time = time.time()
+def handle_device2(msg):
+    '''handle message from rover GPS'''
+    device2.dispatch(msg)
 
-    msg = dev2.receive_message_noerror()
-    if msg is not None:
-        handle_device2(msg)
-        last_msg2_time = time.time()
+def handle_device3_pos(msg):
+    satinfo.recv3_position = util.PosVector(msg.ecefX*0.01, msg.ecefY*0.01, msg.ecefZ*0.01)
 
-    if dev3 is not None:
-        msg = dev3.receive_message_noerror()
-        if msg is not None:
-            handle_device3(msg)
-            last_msg3_time = time.time()
+device3 = ublox.UBloxDispatcher()
+device3.subscribe('NAV_POSECEF', handle_device3_pos)
 
-    if opts.reopen and time.time() > last_msg1_time + 5:
+def handle_device3(msg):
+    '''handle message from uncorrected rover GPS'''
+    device3.dispatch(msg)
+
+def receive_device1(msg):
+    global last_msg1_time
+    handle_device1(msg)
+    last_msg1_time = time.time()
+
+def receive_device2(msg):
+    global last_msg2_time
+    handle_device2(msg)
+    last_msg2_time = time.time()
+
+def receive_device3(msg):
+    global last_msg3_time
+    handle_device3(msg)
+    last_msg3_time = time.time()
+
+def check_reopen():
+    '''re-open any device which has stopped sending'''
+    global dev1, dev2, dev3, last_msg1_time, last_msg2_time, last_msg3_time
+    if time.time() > last_msg1_time + 5:
+        mux.remove_device(dev1)
         dev1.close()
-        dev1 = setup_port(opts.port1, opts.log1, append=True)
+        dev1 = setup_port(opts.port1, opts.log1, append=True, configure=configure_dev1)
+        mux.add_device(dev1, receive_device1)
         last_msg1_time = time.time()
         sys.stdout.write('R1')
 
-    if opts.reopen and time.time() > last_msg2_time + 5:
+    if time.time() > last_msg2_time + 5:
+        mux.remove_device(dev2)
         dev2.close()
-        dev2 = setup_port(opts.port2, opts.log2, append=True)
+        dev2 = setup_port(opts.port2, opts.log2, append=True, configure=configure_dev2)
+        mux.add_device(dev2, receive_device2)
         last_msg2_time = time.time()
         sys.stdout.write('R2')
 
-    if dev3 is not None and opts.reopen and time.time() > last_msg3_time + 5:
+    if dev3 is not None and time.time() > last_msg3_time + 5:
+        mux.remove_device(dev3)
         dev3.close()
-        dev3 = setup_port(opts.port3, opts.log3, append=True)
+        dev3 = setup_port(opts.port3, opts.log3, append=True, configure=configure_dev3)
+        mux.add_device(dev3, receive_device3)
         last_msg3_time = time.time()
         sys.stdout.write('R3')
 
     sys.stdout.flush()
+
+mux = ublox.UBloxMultiplexer()
+mux.add_device(dev1, receive_device1)
+mux.add_device(dev2, receive_device2)
+if dev3 is not None:
+    mux.add_device(dev3, receive_device3)
+if opts.reopen:
+    mux.add_timer(1, check_reopen)
+mux.add_timer(0.1, sys.stdout.flush)
+mux.run()
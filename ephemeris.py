@@ -1,4 +1,4 @@
-import util
+import util, bisect
 
 class EphemerisData:
     '''container for parsing a AID_EPH message
@@ -24,12 +24,18 @@ class EphemerisData:
         v = self.GET_FIELD_U(w, nb, pos)
         return self.twos_complement(v, nb)
 
-    def __init__(self, msg):
+    def __init__(self, msg, fields=None):
+        '''decode msg, or if fields is given take the BATCH_FIELDS values
+        from it, as from a row of batchRows()'''
         from math import pow
 
         self._msg = msg
         self.svid = msg.svid
         self.how = msg.how
+
+        if fields is not None:
+            self.__dict__.update(zip(BATCH_FIELDS, fields))
+            return
         
         if not msg.have_field('sf1d'):
             # it doesn't contain the optional part
@@ -107,6 +113,11 @@ class EphemerisData:
         iode2           = self.GET_FIELD_U(msg.sf3d[7],  8, 16)
         self.valid = (iode1 == iode2) and (iode1 == (iodc & 0xff))
         self.iode = iode1
+        self.iodc = iodc
+
+        # GPS week modulo 1024, and the curve fit interval flag
+        self.week = week_no
+        self.fit_flag = fit_flag
 
     def __eq__(self, other):
         '''allow for equality testing
@@ -180,6 +191,20 @@ class IonosphericData:
                 self.leap))
 #                '''
                   
+    def words(self):
+        '''return the ten subframe words this data decodes from. Older
+        versions saved ionospheric data without its subframe'''
+        def int8(v, scale):
+            return int(round(v / scale)) & 255
+        words = [0] * 10
+        words[0] = 0x8b0000
+        words[1] = self.id << 2
+        words[2] = (self.pageID << 16) | (int8(self.a0, pow(2, -30)) << 8) | int8(self.a1, pow(2, -27))
+        words[3] = (int8(self.a2, pow(2, -24)) << 16) | (int8(self.a3, pow(2, -24)) << 8) | int8(self.b0, pow(2, 11))
+        words[4] = (int8(self.b1, pow(2, 14)) << 16) | (int8(self.b2, pow(2, 16)) << 8) | int8(self.b3, pow(2, 16))
+        words[8] = self.leap << 16
+        return words
+
     def __eq__(self, other):
         '''allow for equality testing
         See http://stackoverflow.com/questions/3550336/comparing-two-objects
@@ -195,3 +220,323 @@ class IonosphericData:
     def __ne__(self, other):
         '''allow for equality testing'''
         return not self.__eq__(other)
+
+
+# broadcast parameters kept in an EphemerisTable, one column each
+EPH_FIELDS = [ 'crs', 'deltaN', 'M0', 'cuc', 'ecc', 'cus', 'A', 'toe', 'cic', 'omega0',
+               'cis', 'i0', 'crc', 'omega', 'omega_dot', 'idot', 'toc', 'af0', 'af1', 'af2', 'Tgd' ]
+
+class EphemerisTable:
+    '''structure of arrays store of broadcast ephemeris parameters
+
+    Each ephemeris is a row, with one numpy array per parameter in
+    columns plus the svid and iode columns. Rows are indexed by (svid,
+    IODE), and the last row added for an svid is its current ephemeris.
+    The result of select() can be passed straight to
+    satPosition.satPositions()
+    '''
+    def __init__(self, capacity=64):
+        import numpy
+        self.count = 0
+        self.columns = {}
+        for f in EPH_FIELDS:
+            self.columns[f] = numpy.zeros(capacity, dtype=numpy.float64)
+        self.columns['svid'] = numpy.zeros(capacity, dtype=numpy.int32)
+        self.columns['iode'] = numpy.zeros(capacity, dtype=numpy.int32)
+        # (svid, iode) -> row
+        self.index = {}
+        # svid -> row of the current ephemeris
+        self.current = {}
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, svid):
+        return svid in self.current
+
+    def __getitem__(self, name):
+        '''return a column for all rows'''
+        return self.columns[name][:self.count]
+
+    def _grow(self):
+        '''double the capacity of the columns'''
+        import numpy
+        for (name, col) in self.columns.items():
+            self.columns[name] = numpy.concatenate((col, numpy.zeros_like(col)))
+
+    def add(self, svid, iode, eph):
+        '''add an ephemeris, taking the parameters from the EPH_FIELDS
+        attributes of eph, and make it current for svid. An ephemeris
+        with the same svid and IODE as an existing row replaces it.
+        Returns the row'''
+        key = (svid, iode)
+        row = self.index.get(key, None)
+        if row is None:
+            if self.count == len(self.columns['svid']):
+                self._grow()
+            row = self.count
+            self.count += 1
+            self.index[key] = row
+        for f in EPH_FIELDS:
+            self.columns[f][row] = getattr(eph, f)
+        self.columns['svid'][row] = svid
+        self.columns['iode'][row] = iode
+        self.current[svid] = row
+        return row
+
+    def discard(self, svid):
+        '''forget the current ephemeris for svid, keeping its rows'''
+        self.current.pop(svid, None)
+
+    def find(self, svid, iode=None):
+        '''return the row of an ephemeris by svid and IODE, or of the
+        current ephemeris for svid if iode is None. Returns None if not
+        found'''
+        if iode is None:
+            return self.current.get(svid, None)
+        return self.index.get((svid, iode), None)
+
+    def lookup(self, svids):
+        '''return an array of the current rows for a list of svids, with
+        -1 for svids without an ephemeris'''
+        import numpy
+        current = self.current
+        return numpy.array([current.get(svid, -1) for svid in svids], dtype=numpy.int64)
+
+    def select(self, rows):
+        '''return a dictionary of the columns for an array of rows. A row
+        which is not in the table, such as the -1 lookup() gives an svid
+        without an ephemeris, raises ValueError'''
+        import numpy
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        if len(rows) and (rows.min() < 0 or rows.max() >= self.count):
+            raise ValueError("no ephemeris in row %d" % [r for r in rows.tolist() if r < 0 or r >= self.count][0])
+        return dict([(name, col[rows]) for (name, col) in self.columns.items()])
+
+
+def fitInterval(eph):
+    '''return the curve fit interval of an ephemeris in seconds. See
+    IS-GPS-200 20.3.4.4, a fit interval flag of 1 means more than 4
+    hours, which is 6 hours for all but a few IODC values'''
+    if getattr(eph, 'fit_flag', 0):
+        return 6*3600
+    return 4*3600
+
+class EphemerisStore:
+    '''history of the ephemerides seen for each svid, by time of ephemeris
+
+    Every IODE seen is kept, in a list per svid sorted on the time of
+    ephemeris (week modulo 1024 and toe), and find() bisects it for the
+    ephemeris with the closest toe whose fit interval covers the time
+    asked for.
+
+    Old entries are evicted on add(). At most max_per_sv entries are
+    kept for each svid, dropping those furthest from the one just
+    added. If max_age is set, entries with a toe more than max_age
+    seconds before the latest time added or asked for are dropped too,
+    which suits live use but not reprocessing old logs
+    '''
+    def __init__(self, max_per_sv=96, max_age=None):
+        self.max_per_sv = max_per_sv
+        self.max_age = max_age
+        # svid -> sorted list of times of ephemeris
+        self.times = {}
+        # svid -> list of ephemerides in the same order
+        self.ephs = {}
+        self.latest = None
+
+    def __len__(self):
+        return sum([len(e) for e in self.ephs.values()])
+
+    def svids(self):
+        '''return the svids with at least one ephemeris'''
+        return [svid for svid in self.ephs if self.ephs[svid]]
+
+    def all(self):
+        '''return a list of all the ephemerides'''
+        ret = []
+        for svid in sorted(self.ephs.keys()):
+            ret.extend(self.ephs[svid])
+        return ret
+
+    def _time(self, week, tow):
+        return (week % 1024) * 604800 + tow
+
+    def add(self, eph):
+        '''add an ephemeris, which needs week and toe attributes. Returns
+        True if it was new or replaced a different ephemeris with the
+        same toe'''
+        t = self._time(eph.week, eph.toe)
+        times = self.times.setdefault(eph.svid, [])
+        ephs = self.ephs.setdefault(eph.svid, [])
+        i = bisect.bisect_left(times, t)
+        if i < len(times) and times[i] == t:
+            changed = ephs[i] != eph
+            ephs[i] = eph
+            return changed
+        times.insert(i, t)
+        ephs.insert(i, eph)
+        self.latest = max(self.latest, t)
+        self._evict(eph.svid, t)
+        return True
+
+    def _evict(self, svid, t):
+        '''apply the eviction policy after adding an ephemeris at time t'''
+        times = self.times[svid]
+        ephs = self.ephs[svid]
+        while len(times) > self.max_per_sv:
+            if t - times[0] > times[-1] - t:
+                i = 0
+            else:
+                i = -1
+            del times[i]
+            del ephs[i]
+        if self.max_age is not None:
+            self.evict(self.latest - self.max_age)
+
+    def evict(self, before):
+        '''drop the entries with a time of ephemeris before the given
+        time, in the week modulo 1024 * 604800 + toe form'''
+        for svid in self.times:
+            i = bisect.bisect_left(self.times[svid], before)
+            if i > 0:
+                del self.times[svid][:i]
+                del self.ephs[svid][:i]
+
+    def find(self, svid, week, tow):
+        '''return the ephemeris for svid with the closest toe whose fit
+        interval covers the given GPS time, or None'''
+        times = self.times.get(svid, None)
+        if not times:
+            return None
+        t = self._time(week, tow)
+        if self.max_age is not None and t > self.latest:
+            self.latest = t
+        ephs = self.ephs[svid]
+        best = None
+        # an ephemeris broadcast late in a week can have its toe in the
+        # next, while the week number is that of transmission
+        for ofs in [0, -604800]:
+            i = bisect.bisect_left(times, t + ofs)
+            for j in [i-1, i]:
+                if j < 0 or j >= len(times):
+                    continue
+                dt = abs(t + ofs - times[j])
+                if dt <= fitInterval(ephs[j]) / 2 and (best is None or dt < best[0]):
+                    best = (dt, ephs[j])
+        if best is None:
+            return None
+        return best[1]
+
+
+# the EphemerisData attributes decodeEphemerides() produces
+BATCH_FIELDS = EPH_FIELDS + [ 'iode', 'iodc', 'week', 'fit_flag', 'valid', 'aodo',
+                              '_rsvd1', '_rsvd2', '_rsvd3', '_rsvd4' ]
+
+# fields within one word, as (name, word, bits, position, signed), with
+# words 0-7 from sf1d, 8-15 from sf2d and 16-23 from sf3d
+_batch_words = [
+    ('week',      0, 10, 14, False),
+    ('t_gd',      4,  8,  0, True),
+    ('iodc_hi',   0,  2,  0, False),
+    ('iodc_lo',   5,  8, 16, False),
+    ('t_oc',      5, 16,  0, False),
+    ('a_f2',      6,  8, 16, True),
+    ('a_f1',      6, 16,  0, True),
+    ('a_f0',      7, 22,  2, True),
+    ('c_rs',      8, 16,  0, True),
+    ('delta_n',   9, 16,  8, True),
+    ('c_uc',     11, 16,  8, True),
+    ('c_us',     13, 16,  8, True),
+    ('t_oe',     15, 16,  8, False),
+    ('fit_flag', 15,  1,  7, False),
+    ('aodo',     15,  5,  2, False),
+    ('c_ic',     16, 16,  8, True),
+    ('c_is',     18, 16,  8, True),
+    ('c_rc',     20, 16,  8, True),
+    ('omega_dot',22, 24,  0, True),
+    ('idot',     23, 14,  2, True),
+    ('iode1',     8,  8, 16, False),
+    ('iode2',    23,  8, 16, False),
+    ('_rsvd1',    1, 23,  0, False),
+    ('_rsvd2',    2, 24,  0, False),
+    ('_rsvd3',    3, 24,  0, False),
+    ('_rsvd4',    4, 16,  8, False),
+    ]
+
+# 32 bit fields split across two words, as (name, high word, signed,
+# low word), with the top 8 bits in bits 0-7 of the high word
+_batch_split = [
+    ('m_0',       9, True,  10),
+    ('e',        11, False, 12),
+    ('a_powhalf',13, False, 14),
+    ('omega_0',  16, True,  17),
+    ('i_0',      18, True,  19),
+    ('w',        20, True,  21),
+    ]
+
+# scaled parameters, as (attribute, raw field, scale)
+_batch_scales = [
+    ('Tgd',       't_gd',      2.0**-31),
+    ('cic',       'c_ic',      2.0**-29),
+    ('cis',       'c_is',      2.0**-29),
+    ('crc',       'c_rc',      2.0**-5),
+    ('crs',       'c_rs',      2.0**-5),
+    ('cuc',       'c_uc',      2.0**-29),
+    ('cus',       'c_us',      2.0**-29),
+    ('deltaN',    'delta_n',   2.0**-43 * util.gpsPi),
+    ('ecc',       'e',         2.0**-33),
+    ('i0',        'i_0',       2.0**-31 * util.gpsPi),
+    ('idot',      'idot',      2.0**-43 * util.gpsPi),
+    ('M0',        'm_0',       2.0**-31 * util.gpsPi),
+    ('omega',     'w',         2.0**-31 * util.gpsPi),
+    ('omega_dot', 'omega_dot', 2.0**-43 * util.gpsPi),
+    ('omega0',    'omega_0',   2.0**-31 * util.gpsPi),
+    ('toe',       't_oe',      2.0**4),
+    ('toc',       't_oc',      2.0**4),
+    ('af0',       'a_f0',      2.0**-31),
+    ('af1',       'a_f1',      2.0**-43),
+    ('af2',       'a_f2',      2.0**-55),
+    ]
+
+def decodeEphemerides(words):
+    '''batch version of EphemerisData: decode an Nx24 array of the sf1d,
+    sf2d and sf3d words of N AID_EPH or RXM_EPH messages at once. Returns
+    a dictionary of arrays named as the BATCH_FIELDS attributes of
+    EphemerisData. valid is set where the IODE of subframes 2 and 3 and
+    the low 8 bits of the IODC agree'''
+    import numpy
+    w = numpy.asarray(words, dtype=numpy.int64).reshape(-1, 24)
+    raw = {}
+    for (name, word, nb, pos, signed) in _batch_words:
+        v = (w[:,word] >> pos) & ((1<<nb)-1)
+        if signed:
+            v -= (v >> (nb-1)) << nb
+        raw[name] = v
+    for (name, hi, signed, lo) in _batch_split:
+        v = w[:,hi] & 0xff
+        if signed:
+            v -= (v >> 7) << 8
+        raw[name] = (v << 24) | (w[:,lo] & 0xffffff)
+
+    ret = {}
+    for (attr, name, scale) in _batch_scales:
+        ret[attr] = raw[name] * scale
+    # as pow() in EphemerisData, so the results are identical. An array
+    # exponent stops numpy turning this into a multiply, which can round
+    # differently
+    a_half = raw['a_powhalf'] * 2.0**-19
+    ret['A'] = numpy.power(a_half, numpy.full_like(a_half, 2.0))
+
+    iodc = (raw['iodc_hi'] << 8) | raw['iodc_lo']
+    ret['iode'] = raw['iode1']
+    ret['iodc'] = iodc
+    ret['valid'] = (raw['iode1'] == raw['iode2']) & (raw['iode1'] == (iodc & 0xff))
+    for f in [ 'week', 'fit_flag', 'aodo', '_rsvd1', '_rsvd2', '_rsvd3', '_rsvd4' ]:
+        ret[f] = raw[f]
+    return ret
+
+def batchRows(batch):
+    '''return the rows of the result of decodeEphemerides() as tuples of
+    python values in BATCH_FIELDS order'''
+    return zip(*[batch[f].tolist() for f in BATCH_FIELDS])
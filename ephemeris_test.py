@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''
+test the batch ephemeris decoding and the ephemeris table used by the
+batch satellite calculations
+'''
+
+import ephemeris, ublox, sys, random
+
+class FakeEphemeris:
+    '''an object with every EPH_FIELDS attribute set to value'''
+    def __init__(self, value):
+        for f in ephemeris.EPH_FIELDS:
+            setattr(self, f, value)
+
+def test_table():
+    '''check lookup() and select() for present and missing svids'''
+    table = ephemeris.EphemerisTable()
+    for svid in [3, 7, 12]:
+        table.add(svid, 1, FakeEphemeris(float(svid)))
+    table.add(7, 2, FakeEphemeris(70.0))
+    rows = table.lookup([12, 7, 3])
+    ephs = table.select(rows)
+    if ephs['svid'].tolist() != [12, 7, 3] or ephs['A'].tolist() != [12.0, 70.0, 3.0]:
+        print("select of current ephemerides failed")
+        return False
+    if table.lookup([3, 5]).tolist()[1] != -1:
+        print("lookup of missing svid did not give -1")
+        return False
+    for rows in [table.lookup([3, 5]), [len(table)]]:
+        try:
+            table.select(rows)
+        except ValueError:
+            continue
+        print("select of missing row %s did not fail" % rows)
+        return False
+    if len(table.select(table.lookup([]))['A']) != 0:
+        print("select of no rows failed")
+        return False
+    print("ephemeris table OK")
+    return True
+
+def test_decode(count=5000):
+    '''check decodeEphemerides() gives exactly the values EphemerisData
+    does for random subframe words'''
+    rand = random.Random(1)
+    words = [[rand.randint(0, (1<<24)-1) for j in range(24)] for i in range(count)]
+    batch = ephemeris.decodeEphemerides(words)
+    for (i, row) in enumerate(ephemeris.batchRows(batch)):
+        msg = ublox.UBloxMessage()
+        msg._fields = { 'svid' : 1, 'how' : 0,
+                        'sf1d' : words[i][0:8], 'sf2d' : words[i][8:16], 'sf3d' : words[i][16:24] }
+        msg._unpacked = True
+        eph = ephemeris.EphemerisData(msg)
+        for (f, v) in zip(ephemeris.BATCH_FIELDS, row):
+            if getattr(eph, f) != v:
+                print("batch %s %r differs from %r for words %s" % (f, v, getattr(eph, f), words[i]))
+                return False
+    print("batch decode OK")
+    return True
+
+ok = test_table()
+ok = test_decode() and ok
+sys.exit(0 if ok else 1)
@@ -23,6 +23,7 @@ parser.add_option("--plot-skymap", help="Plot skymap for sats with residual over
 parser.add_option("--plot-clusters", help="Plot skymap for sats with residual over n metres, split in to performance clusters, -1 for disable", type=int, default=-1)
 parser.add_option("--split-by-time", type=float, default=None, help="Plot the error performance split in to periods")
 parser.add_option("--timezone", type=float, default=10.0, help="Receiver time zone, used only to display good plot labels")
+parser.add_option("--processes", type=int, default=1, help="Number of processes to use when parsing the UBX log")
 
 (opts, args) = parser.parse_args()
 
@@ -102,39 +103,40 @@ if (sat_el is None or sat_az is None or sat_res is None or t_first is None) \
         t_wrap = 0
 
     print("Parsing UBX")
-    dev = ublox.UBlox(opts.ubx_log)
-
-    while True:
+    index = ublox.UBloxLogIndex(opts.ubx_log, processes=opts.processes)
+    svinfo = [(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO)]
+    if opts.processes > 1:
+        msgs = index.parallel_messages(svinfo, processes=opts.processes)
+    else:
+        msgs = index.messages(svinfo)
+
+    for msg in msgs:
         '''process the ublox messages, extracting the ones we need for the sat position'''
-        msg = dev.receive_message()
-        if msg is None:
-            break
-        if msg.name() == 'NAV_SVINFO':
-            msg.unpack()
-            t = msg.iTOW * 0.001
+        msg.unpack()
+        t = msg.iTOW * 0.001
 
-            if t_first == 0:
-                t_first = t
+        if t_first == 0:
+            t_first = t
 
-            if t_last != 0 and t - t_last >= 2:
-                print("Missed Epoch")
+        if t_last != 0 and t - t_last >= 2:
+            print("Missed Epoch")
 
-            if t < t_first and t_wrap == 0:
-                t_wrap = t_last
+        if t < t_first and t_wrap == 0:
+            t_wrap = t_last
 
-            t += t_wrap
+        t += t_wrap
 
-            t_last = t
+        t_last = t
 
-            for s in msg.recs:
-                if not s.flags & 1: # ignore svs not used in soln
-                    continue
+        for s in msg.recs:
+            if not s.flags & 1: # ignore svs not used in soln
+                continue
 
-                sat_el[t - t_first, s.svid] = s.elev
-                sat_az[t - t_first, s.svid] = s.azim
+            sat_el[t - t_first, s.svid] = s.elev
+            sat_az[t - t_first, s.svid] = s.azim
 
-                if opts.satlog is None:
-                    sat_res[t - t_first, s.svid] = s.prRes / 100.   # Resid in cm
+            if opts.satlog is None:
+                sat_res[t - t_first, s.svid] = s.prRes / 100.   # Resid in cm
 
 if opts.save_pos is not None:
     util.saveObject(opts.save_pos, (sat_el, sat_az, sat_res))
@@ -34,6 +34,7 @@ def setup_port(port, log, append=False):
     dev = ublox.UBlox(port, baudrate=opts.baudrate, timeout=0.01)
     dev.set_logfile(log, append=append)
     dev.set_binary()
+    dev.begin_config()
     dev.configure_poll_port()
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_USB)
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_NAVX5)
@@ -47,18 +48,20 @@ def setup_port(port, log, append=False):
     dev.configure_poll_port(ublox.PORT_SERIAL1)
     dev.configure_poll_port(ublox.PORT_SERIAL2)
     dev.configure_poll_port(ublox.PORT_USB)
+
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
+    dev.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_RAW, 1)
+    dev.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SFRB, 1)
+    dev.configure_message_rate(ublox.CLASS_AID, ublox.MSG_AID_EPH, 1)
+    dev.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 1)
+    dev.configure_solution_rate(rate_ms=200)
+
+    dev.end_config(ublox.show_config_failures)
     return dev
 
 dev1 = setup_port(opts.port, opts.log, append=opts.append)
 
-dev1.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH, 1)
-dev1.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, 1)
-dev1.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_RAW, 1)
-dev1.configure_message_rate(ublox.CLASS_RXM, ublox.MSG_RXM_SFRB, 1)
-dev1.configure_message_rate(ublox.CLASS_AID, ublox.MSG_AID_EPH, 1)
-dev1.configure_message_rate(ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO, 1)
-dev1.configure_solution_rate(rate_ms=200)
-
 # we want the ground station to use a stationary model, and the roving
 # GPS to use a highly dynamic model
 dev1.set_preferred_dynamic_model(opts.dynmodel1)
@@ -168,20 +171,26 @@ def position_estimate(messages, satinfo):
 
 pos_count = 0
 
-while True:
-    # get a message from the reference GPS
-    msg = dev1.receive_message_noerror()
-    if msg is None:
-        break
-
-    #if msg is not None:
+def receive_device1(msg):
+    global last_msg1_time
     handle_device1(msg)
     last_msg1_time = time.time()
+    sys.stdout.flush()
 
-    if opts.reopen and time.time() > last_msg1_time + 5:
+def check_reopen():
+    '''re-open the receiver if it has stopped sending'''
+    global dev1, last_msg1_time
+    if time.time() > last_msg1_time + 5:
+        mux.remove_device(dev1)
         dev1.close()
-        dev1 = setup_port(opts.port1, opts.log1, append=True)
+        dev1 = setup_port(opts.port, opts.log, append=True)
+        mux.add_device(dev1, receive_device1)
         last_msg1_time = time.time()
         sys.stdout.write('R1')
+        sys.stdout.flush()
 
-    sys.stdout.flush()
+mux = ublox.UBloxMultiplexer()
+mux.add_device(dev1, receive_device1)
+if opts.reopen:
+    mux.add_timer(1, check_reopen)
+mux.run()
@@ -3,7 +3,7 @@
 Locally-generated DGPS corrections, publish as UDP datagrams
 '''
 
-import ublox, sys, time, struct, select, subprocess
+import ublox, sys, time, struct, subprocess
 import ephemeris
 import RTCMv2
 
@@ -34,6 +34,7 @@ def setup_port(port, log, append=False):
     dev = ublox.UBlox(port, baudrate=opts.baudrate, timeout=0.01)
     dev.set_logfile(log, append=append)
     dev.set_binary()
+    dev.begin_config()
     dev.configure_poll_port()
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_USB)
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_NAVX5)
@@ -65,6 +66,7 @@ def setup_port(port, log, append=False):
     # enable PPP on the ground side if we can
     dev.set_preferred_usePPP(opts.usePPP)
 
+    dev.end_config(ublox.show_config_failures)
     return dev
 
 if opts.port1 is not None:
@@ -140,39 +142,33 @@ def handle_device1(msg):
 
 pos_count = 0
 
-while True:
-
-    if opts.port1 is not None:
-        # get a message from the reference GPS
-        msg = dev1.receive_message_noerror()
-
-        if msg is not None:
-            handle_device1(msg)
-            last_msg1_time = time.time()
-
-            print '1: {}'.format(msg.name())
-
-    if dev2 is not None:
-        msg = dev2.receive_message_noerror()
-        if msg is not None:
-            print '2: {}'.format(msg.name())
-
-    if dev3 is not None:
-        msg = dev3.receive_message_noerror()
-        if msg is not None:
-            print '3: {}'.format(msg.name())
-
-    if opts.ntrip_user is not None:
-        # There's got to be a better way (without threading)
-        r, w, x = select.select([ntrip_pipe], [nfile], [], 0)
-        up = False
-        while ntrip_pipe in r and nfile in w:
-            up = True
-            nfile.write(ntrip_pipe.read(1))
-            r, w, x = select.select([ntrip_pipe], [nfile], [], 0)
-
-        if up:
-            print 'N'
-            nfile.flush()
+def receive_device1(msg):
+    global last_msg1_time
+    handle_device1(msg)
+    last_msg1_time = time.time()
+    print '1: {}'.format(msg.name())
+    sys.stdout.flush()
 
+def receive_device(n):
+    '''return a multiplexer callback which logs messages from device n'''
+    def callback(msg):
+        print '{}: {}'.format(n, msg.name())
+        sys.stdout.flush()
+    return callback
+
+def receive_ntrip(data):
+    nfile.write(data)
+    nfile.flush()
+    print 'N'
     sys.stdout.flush()
+
+mux = ublox.UBloxMultiplexer()
+if opts.port1 is not None:
+    mux.add_device(dev1, receive_device1)
+if dev2 is not None:
+    mux.add_device(dev2, receive_device(2))
+if dev3 is not None:
+    mux.add_device(dev3, receive_device(3))
+if ntrip_pipe is not None:
+    mux.add_source(ntrip_pipe, receive_ntrip)
+mux.run()
@@ -1,41 +1,51 @@
 #! /usr/bin/env python
 
-import ublox
+import ublox, util
 import sys
+import numpy
 
 from pylab import *
 
-dev = ublox.UBlox(sys.argv[1])
+def count_sats():
+    '''count satellites in each RXM_RAW and NAV_SVINFO message of the log'''
+    dev = ublox.UBlox(sys.argv[1])
 
-raw = []
-svi = []
-pos = []
+    raw = []
+    svi = []
+    pos = []
 
-while True:
-    msg = dev.receive_message()
+    types = set([(ublox.CLASS_RXM, ublox.MSG_RXM_RAW),
+                 (ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO)])
 
-    if msg is None:
-        break
+    while True:
+        msg = dev.receive_message(types=types)
 
-    n = msg.name()
+        if msg is None:
+            break
 
-    if n not in ['RXM_RAW', 'NAV_SVINFO']:
-        continue
+        n = msg.name()
 
-    msg.unpack()
+        msg.unpack()
 
-    if n == 'RXM_RAW':
-        raw.append(msg.numSV)
-    elif n == 'NAV_SVINFO':
-        svi.append(msg.numCh)
+        if n == 'RXM_RAW':
+            raw.append(msg.numSV)
+        elif n == 'NAV_SVINFO':
+            svi.append(msg.numCh)
 
-        # count how many of the active channels are used in the pos solution
-        c = 0
-        for s in msg.recs:
-            if s.flags & 1:
-                c += 1
+            # count how many of the active channels are used in the pos solution
+            c = 0
+            for s in msg.recs:
+                if s.flags & 1:
+                    c += 1
 
-        pos.append(c)
+            pos.append(c)
+
+    return {'raw' : numpy.array(raw), 'svi' : numpy.array(svi), 'pos' : numpy.array(pos)}
+
+counts = util.cachedArrays([sys.argv[1]], 'satcount', count_sats)
+raw = counts['raw']
+svi = counts['svi']
+pos = counts['pos']
 
 plot(raw, label="Raw")
 plot(svi, label="SVI")
@@ -72,18 +72,18 @@ def clockLeastSquares_ranges(eph, pranges, itow, ref_pos, last_clock_error, weig
     from scipy import optimize
     data = [ref_pos]
 
-    for svid in pranges:
-        if svid in eph:
-            if weights is not None:
-                weight = weights[svid]
-            else:
-                weight = 1.0
-
-            tof = pranges[svid] / util.speedOfLight
-            transmitTime = itow - tof
-            satpos = satPosition.satPosition_raw(eph[svid], svid, transmitTime)
-
-            data.append((satpos, pranges[svid], weight))
+    svids = [svid for svid in pranges if svid in eph]
+    tof = [pranges[svid] / util.speedOfLight for svid in svids]
+    transmitTime = [itow - t for t in tof]
+    satpos, Trel, dTclck = satPosition.satPositions(
+        satPosition.ephemerisArray([eph[svid] for svid in svids]), transmitTime, svids)
+
+    for i, svid in enumerate(svids):
+        if weights is not None:
+            weight = weights[svid]
+        else:
+            weight = 1.0
+        data.append((util.PosVector(*satpos[i]), pranges[svid], weight))
 
     if len(data) < 4:
         return
@@ -149,45 +149,43 @@ def positionLeastSquares(satinfo):
 
 
 def calculatePrCorrections(satinfo):
+    import numpy
     raw = satinfo.raw
     satinfo.reset()
     errset={}
-    for svid in raw.prMeasured:
-
-        if not satinfo.valid(svid):
-            # we don't have ephemeris data for this space vehicle
-            #print("not valid")
-            continue
 
-        # get the ephemeris and pseudo-range for this space vehicle
-        ephemeris = satinfo.ephemeris[svid]
-        prMes = raw.prMeasured[svid]
-        prSmooth = satinfo.smooth.prSmoothed[svid]
+    # we need ephemeris data for the space vehicle
+    svids = [svid for svid in raw.prMeasured if satinfo.valid(svid)]
 
-        # calculate the time of flight for this pseudo range
-        tof = prSmooth / util.speedOfLight
+    # calculate the time of flight for each smoothed pseudo range
+    tof = numpy.array([satinfo.smooth.prSmoothed[svid] for svid in svids]) / util.speedOfLight
 
-        # assume the time_of_week is the exact receiver time of week that the message arrived.
-        # subtract the time of flight to get the satellite transmit time
-        transmitTime = raw.time_of_week - tof
+    # assume the time_of_week is the exact receiver time of week that the message arrived.
+    # subtract the time of flight to get the satellite transmit time
+    transmitTimes = raw.time_of_week - tof
 
-        timesec = util.gpsTimeToTime(raw.gps_week, raw.time_of_week)
+    # calculate the satellite positions at the transmitTime and the clock corrections,
+    # then correct for earths rotation in the time it took the messages to get to the receiver
+    eph = satinfo.eph_table.select(satinfo.eph_table.lookup(svids))
+    satpos, Trel, dTclck = satPosition.satPositions(eph, transmitTimes, svids)
+    satpos = satPosition.correctPositions(satpos, tof)
 
-        # calculate the satellite position at the transmitTime
-        satPosition.satPosition(satinfo, svid, transmitTime)
-        Trel = satinfo.satpos[svid].extra
+    for i, svid in enumerate(svids):
+        # get the pseudo-ranges for this space vehicle
+        prMes = raw.prMeasured[svid]
+        prSmooth = satinfo.smooth.prSmoothed[svid]
+        transmitTime = float(transmitTimes[i])
 
-        # correct for earths rotation in the time it took the messages to get to the receiver
-        satPosition.correctPosition(satinfo, svid, tof)
+        satinfo.satpos[svid] = util.PosVector(*satpos[i], extra=Trel[i])
 
         # calculate satellite azimuth and elevation
         satPosition.calculateAzimuthElevation(satinfo, svid, satinfo.lastpos)
 
-        # calculate the satellite clock correction
-        sat_clock_error = rangeCorrection.sv_clock_correction(satinfo, svid, transmitTime, Trel)
+        # the satellite clock correction
+        sat_clock_error = float(dTclck[i])
 
         # calculate the satellite group delay
-        sat_group_delay = -satinfo.ephemeris[svid].Tgd
+        sat_group_delay = -float(eph['Tgd'][i])
 
         # calculate the ionospheric range correction
         ion_corr = rangeCorrection.ionospheric_correction(satinfo, svid, transmitTime, satinfo.lastpos)
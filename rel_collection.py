@@ -29,6 +29,7 @@ def setup_port(port, log, append=False):
     dev = ublox.UBlox(port, baudrate=opts.baudrate, timeout=0.01)
     dev.set_logfile(log, append=append)
     dev.set_binary()
+    dev.begin_config()
     dev.configure_poll_port()
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_USB)
     dev.configure_poll(ublox.CLASS_CFG, ublox.MSG_CFG_NAVX5)
@@ -56,6 +57,7 @@ def setup_port(port, log, append=False):
     dev.set_preferred_dynamic_model(ublox.DYNAMIC_MODEL_AIRBORNE4G)
     dev.set_preferred_dgps_timeout(60)
 
+    dev.end_config(ublox.show_config_failures)
     return dev
 
 base = setup_port(opts.base, opts.log_prefix + "-base.ubx")
@@ -143,26 +145,34 @@ def _count(idx, msg):
         counts[idx][msg.name()] += 1
     return msg
 
-while True:
-    # get a message from the reference GPS
-    msg = _count(0, base.receive_message_noerror())
-    if msg is not None:
-        handle_device1(msg)
-        
-    msg = _count(1, corr1.receive_message_noerror())
-    if msg is not None and msg.name() == 'NAV_DGPS':
-        msg.unpack()
-        print("Corr1 DGPS: age=%u numCh=%u" % (msg.age, msg.numCh))
-
-    msg = _count(2, corr2.receive_message_noerror())
-    if msg is not None and msg.name() == 'NAV_DGPS':
-        msg.unpack()
-        print("Corr2 DGPS: age=%u numCh=%u" % (msg.age, msg.numCh))
-
-    msg = _count(3, uncorr1.receive_message_noerror())
-
+def print_counts():
     for i, dc in enumerate(counts):
         print i, dc
     print '---'
-
     sys.stdout.flush()
+
+def receive_base(msg):
+    _count(0, msg)
+    handle_device1(msg)
+    print_counts()
+
+def receive_corr(idx, label):
+    '''return a multiplexer callback for a corrected receiver'''
+    def callback(msg):
+        _count(idx, msg)
+        if msg.name() == 'NAV_DGPS':
+            msg.unpack()
+            print("%s DGPS: age=%u numCh=%u" % (label, msg.age, msg.numCh))
+        print_counts()
+    return callback
+
+def receive_uncorr(msg):
+    _count(3, msg)
+    print_counts()
+
+mux = ublox.UBloxMultiplexer()
+mux.add_device(base, receive_base)
+mux.add_device(corr1, receive_corr(1, 'Corr1'))
+mux.add_device(corr2, receive_corr(2, 'Corr2'))
+mux.add_device(uncorr1, receive_uncorr)
+mux.run()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import sys
+import sys, util
 from pylab import *
 
 from optparse import OptionParser
@@ -15,25 +15,33 @@ def safe_float(s):
     except ValueError:
         return 0.0
 
-rfile = open(args[0])
-efile = open(args[1])
+def parse_logs():
+    '''pair the elevation and residual of each satellite in each epoch'''
+    rfile = open(args[0])
+    efile = open(args[1])
 
-xdat, ydat = [], []
+    xdat, ydat = [], []
 
-while True:
-    rline = rfile.readline().split(',')
-    eline = efile.readline().split(',')
+    while True:
+        rline = rfile.readline().split(',')
+        eline = efile.readline().split(',')
 
-    rline = [safe_float(x) for x in rline]
-    eline = [safe_float(x) for x in eline]
+        rline = [safe_float(x) for x in rline]
+        eline = [safe_float(x) for x in eline]
 
-    if len(rline) != 33 or len(eline) != 33:
-        break
+        if len(rline) != 33 or len(eline) != 33:
+            break
 
-    for i in range(32):
-        if rline[i] != 0: #and abs(rline[i]) < 1000.0 and eline[i] != 0:
-            xdat.append(eline[i])
-            ydat.append(rline[i])
+        for i in range(32):
+            if rline[i] != 0: #and abs(rline[i]) < 1000.0 and eline[i] != 0:
+                xdat.append(eline[i])
+                ydat.append(rline[i])
+
+    return {'xdat' : array(xdat), 'ydat' : array(ydat)}
+
+data = util.cachedArrays(args[:2], 'elscatter', parse_logs)
+xdat = data['xdat']
+ydat = data['ydat']
 
 figure()
 title("Correction vs Elevation")
@@ -3,7 +3,7 @@ Functions for calculating satellite position given ephemeris data and time
 Thanks to Paul Riseborough for lots of help with this!
 '''
 
-import util
+import util, ephemeris
 
 
 def satPosition(satinfo, svid, transmitTime):
@@ -106,6 +106,133 @@ def satPosition_raw(eph, svid, transmitTime):
 
     return satpos
 
+# ephemeris fields used by the batch functions, one column each
+EPH_FIELDS = ephemeris.EPH_FIELDS
+
+def ephemerisArray(ephs):
+    '''return a numpy record array with the EPH_FIELDS of a list of
+    ephemerides, one row per ephemeris'''
+    import numpy
+    ret = numpy.zeros(len(ephs), dtype=[(f, numpy.float64) for f in EPH_FIELDS])
+    ret[:] = [tuple([getattr(eph, f) for f in EPH_FIELDS]) for eph in ephs]
+    return ret
+
+def satPositions(eph, transmitTime, svids=None):
+    '''calculate the positions of a batch of satellites, as satPosition_raw()
+    does for one.
+
+    eph is anything indexed by the EPH_FIELDS names giving one array
+    element per satellite, such as the result of ephemerisArray() or
+    EphemerisTable.select().
+    transmitTime is a scalar or an array of transmit times. svids is only
+    used in warnings.
+
+    Returns (pos, Trel, dTclck), where pos is an Nx3 array of ECEF
+    positions, Trel the relativistic correction term and dTclck the
+    satellite clock correction including Trel but not Tgd, as from
+    rangeCorrection.sv_clock_correction()
+    '''
+    import numpy
+
+    # WGS 84 value of earth's univ. grav. par.
+    mu = 3.986005E+14
+
+    # WGS 84 value of earth's rotation rate
+    Wedot = 7.2921151467E-5
+
+    # relativistic correction term constant
+    F = -4.442807633E-10
+
+    A   = numpy.asarray(eph['A'], dtype=numpy.float64)
+    ec  = numpy.asarray(eph['ecc'], dtype=numpy.float64)
+    Toe = numpy.asarray(eph['toe'], dtype=numpy.float64)
+    transmitTime = numpy.asarray(transmitTime, dtype=numpy.float64)
+
+    T = weeklyTimes(transmitTime - Toe)
+
+    n0 = numpy.sqrt(mu / (A*A*A))
+    n = n0 + eph['deltaN']
+
+    # solve Kepler's equation, only iterating on the satellites which
+    # haven't converged yet
+    M = eph['M0'] + n*T
+    E = numpy.array(M, dtype=numpy.float64)
+    active = numpy.arange(len(E))
+    for ii in range(20):
+        Eold = E[active]
+        E[active] = M[active] + ec[active] * numpy.sin(Eold)
+        step = E[active] - Eold
+        unconverged = numpy.abs(step) >= 1.0e-12
+        active = active[unconverged]
+        if len(active) == 0:
+            break
+    for (i, d) in zip(active, step[unconverged]):
+        print("WARNING: Kepler Eqn didn't converge for sat {} (last step {})".format(
+            svids[i] if svids is not None else i, d))
+
+    sinE = numpy.sin(E)
+    cosE = numpy.cos(E)
+    snu = numpy.sqrt(1 - ec*ec) * sinE / (1 - ec*cosE)
+    cnu = (cosE - ec) / (1 - ec*cosE)
+    nu = numpy.arctan2(snu, cnu)
+
+    phi = nu + eph['omega']
+    cos2phi = numpy.cos(2*phi)
+    sin2phi = numpy.sin(2*phi)
+
+    du = eph['cuc']*cos2phi + eph['cus']*sin2phi
+    dr = eph['crc']*cos2phi + eph['crs']*sin2phi
+    di = eph['cic']*cos2phi + eph['cis']*sin2phi
+
+    u = phi + du
+    r = A*(1 - ec*cosE) + dr
+    i = eph['i0'] + eph['idot']*T + di
+
+    Xdash = r*numpy.cos(u)
+    Ydash = r*numpy.sin(u)
+
+    Wc = eph['omega0'] + (eph['omega_dot'] - Wedot)*T - Wedot*Toe
+    cosWc = numpy.cos(Wc)
+    sinWc = numpy.sin(Wc)
+    cosi = numpy.cos(i)
+
+    pos = numpy.empty((len(E), 3))
+    pos[:,0] = Xdash*cosWc - Ydash*cosi*sinWc
+    pos[:,1] = Xdash*sinWc + Ydash*cosi*cosWc
+    pos[:,2] = Ydash*numpy.sin(i)
+
+    # relativistic correction term
+    Trel = F * ec * numpy.sqrt(A) * sinE
+
+    Tc = weeklyTimes(transmitTime - eph['toc'])
+    dTclck = eph['af0'] + eph['af1'] * Tc + eph['af2'] * Tc * Tc + Trel
+
+    return (pos, Trel, dTclck)
+
+def weeklyTimes(t):
+    '''array version of util.correctWeeklyTime()'''
+    import numpy
+    t = numpy.array(t, dtype=numpy.float64)
+    t[t > 302400] -= 604800
+    t[t < -302400] += 604800
+    return t
+
+def correctPositions(pos, time_of_flight):
+    '''array version of correctPosition_raw(), returning the Nx3 positions
+    corrected for the earth's rotation during their times of flight'''
+    import numpy
+
+    # WGS-84 earth rotation rate
+    We = 7.292115E-5
+
+    alpha = numpy.asarray(time_of_flight) * We
+    cosa = numpy.cos(alpha)
+    sina = numpy.sin(alpha)
+    ret = numpy.array(pos, dtype=numpy.float64)
+    ret[:,0] = pos[:,0] * cosa + pos[:,1] * sina
+    ret[:,1] = -pos[:,0] * sina + pos[:,1] * cosa
+    return ret
+
 def correctPosition(satinfo, svid, time_of_flight):
     correctPosition_raw(satinfo.satpos[svid], time_of_flight)
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''
+test importing the ephemeris.dat and ionospheric.dat pickles saved by
+older versions into the satellite data journal
+'''
+
+import ublox, satelliteData, ephemeris, util, sys, os, shutil, tempfile
+
+from optparse import OptionParser
+
+parser = OptionParser("satdata_test.py [options] <directory|file.ubx>...")
+parser.add_option("--keep", action='store_true', default=False, help="keep the test directories")
+
+(opts, args) = parser.parse_args()
+
+# the attributes a UBloxMessage had when the pickles were used
+old_attributes = ['_buf', '_fields', '_recs', '_unpacked', 'debug_level']
+
+def old_message(msg):
+    '''strip a message to the attributes of an older version'''
+    for k in msg.__dict__.keys():
+        if not k in old_attributes:
+            del msg.__dict__[k]
+    return msg
+
+def save_pickles(logfile):
+    '''save the pickles older versions would have saved from a log'''
+    ephs = {}
+    ions = {}
+    dev = ublox.UBlox(logfile)
+    types = [(ublox.CLASS_AID, ublox.MSG_AID_EPH), (ublox.CLASS_RXM, ublox.MSG_RXM_SFRB)]
+    for msg in dev.messages(types=types):
+        msg.unpack()
+        if msg.name() == 'AID_EPH':
+            eph = ephemeris.EphemerisData(old_message(msg))
+            if eph.valid:
+                ephs[eph.svid] = eph
+        else:
+            ion = ephemeris.IonosphericData(msg)
+            if ion.valid:
+                ions[msg.svid] = ion
+    util.saveObject('ephemeris.dat', ephs)
+    util.saveObject('ionospheric.dat', ions)
+
+def expected_ephemerides():
+    '''return the valid ephemerides in ephemeris.dat'''
+    ephs = util.loadObject('ephemeris.dat')
+    if ephs is None:
+        return []
+    if isinstance(ephs, dict):
+        ephs = ephs.values()
+    else:
+        ephs = ephs.all()
+    return [eph for eph in ephs if eph.valid]
+
+def expected_ionospheric():
+    '''return the valid ionospheric data in ionospheric.dat'''
+    ions = util.loadObject('ionospheric.dat')
+    if ions is None:
+        return []
+    return [ion for ion in ions.values() if ion.valid]
+
+def test(source):
+    '''import the pickles from a directory, or made from a log, into a
+    new journal, returning the number of ephemerides and ionospheric
+    data checked'''
+    if os.path.isdir(source):
+        for f in ['ephemeris.dat', 'ionospheric.dat']:
+            if os.path.exists(os.path.join(source, f)):
+                shutil.copy(os.path.join(source, f), '.')
+    else:
+        save_pickles(source)
+    expected = expected_ephemerides()
+    expected_ion = expected_ionospheric()
+    for attempt in ['pickles', 'journal']:
+        satinfo = satelliteData.SatelliteData()
+        imported = satinfo.eph_store.all()
+        for eph in expected:
+            if not [e for e in imported if e == eph]:
+                raise ublox.UBloxError('ephemeris for svid %u missing after load from %s' % (eph.svid, attempt))
+        for ion in expected_ion:
+            if satinfo.ionospheric.get(ion.svid, None) != ion:
+                raise ublox.UBloxError('ionospheric data for svid %u missing after load from %s' % (ion.svid, attempt))
+    return (len(expected), len(expected_ion))
+
+ret = 0
+for source in args:
+    source = os.path.abspath(source)
+    print('Testing %s' % source)
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp(prefix='satdata_test')
+    os.chdir(tmpdir)
+    try:
+        print("tested %u ephemerides and %u ionospheric OK" % test(source))
+    except ublox.UBloxError as e:
+        print(e)
+        ret = 1
+    os.chdir(cwd)
+    if opts.keep:
+        print('kept %s' % tmpdir)
+    else:
+        shutil.rmtree(tmpdir)
+sys.exit(ret)
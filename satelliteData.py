@@ -1,4 +1,61 @@
-import util, ephemeris, prSmooth
+import util, ephemeris, prSmooth, ublox, os, pickle
+
+# the satellite data journal, in the working directory, and its kinds
+# of record
+JOURNAL_FILE = 'satdata.jnl'
+JOURNAL_AID_EPH = 1
+JOURNAL_RXM_SFRB = 2
+
+def journalWords(msg):
+    '''return the words to journal for an AID_EPH or RXM_SFRB message'''
+    if msg.have_field('dwrd'):
+        return msg.dwrd
+    return [msg.how] + msg.sf1d + msg.sf2d + msg.sf3d
+
+def pickledWords(eph):
+    '''return the words to journal for an EphemerisData unpickled from an
+    ephemeris.dat. They are taken from the field dictionary of the message
+    it kept, so messages pickled by older versions, which lack attributes
+    UBloxMessage has gained since, need not be usable as messages'''
+    fields = eph._msg.__dict__.get('_fields', {})
+    if not 'sf1d' in fields:
+        # the message was unpacked lazily, and the fields not all cached
+        return journalWords(eph._msg)
+    return [fields['how']] + list(fields['sf1d']) + list(fields['sf2d']) + list(fields['sf3d'])
+
+def journalMessage(kind, svid, words):
+    '''rebuild the message a journal record was made from'''
+    msg = ublox.UBloxMessage()
+    if kind == JOURNAL_AID_EPH:
+        msg._fields = { 'svid' : svid, 'how' : words[0],
+                        'sf1d' : words[1:9], 'sf2d' : words[9:17], 'sf3d' : words[17:25] }
+    else:
+        msg._fields = { 'chn' : 0, 'svid' : svid, 'dwrd' : words[:10] }
+    msg._unpacked = True
+    return msg
+
+def journalEphemerides(kinds, svids, words):
+    '''return the valid ephemerides in journal records, decoded as one batch'''
+    idx = (kinds == JOURNAL_AID_EPH).nonzero()[0]
+    batch = ephemeris.decodeEphemerides(words[idx,1:25])
+    valid = batch['valid']
+    idx = idx[valid]
+    for f in batch:
+        batch[f] = batch[f][valid]
+    svids = svids[idx].tolist()
+    words = words[idx].tolist()
+    ret = []
+    for (i, fields) in enumerate(ephemeris.batchRows(batch)):
+        msg = journalMessage(JOURNAL_AID_EPH, svids[i], words[i])
+        ret.append(ephemeris.EphemerisData(msg, fields))
+    return ret
+
+def journalIonospheric(kinds, svids, words):
+    '''return the words of the latest ionospheric record for each svid'''
+    ret = {}
+    for i in (kinds == JOURNAL_RXM_SFRB).nonzero()[0].tolist():
+        ret[int(svids[i])] = words[i].tolist()
+    return ret
 
 class rawPseudoRange:
     '''class to hold raw range information from a receiver'''
@@ -25,7 +82,7 @@ class rawPseudoRange:
 class SatelliteData:
     '''class to hold satellite data from AID_EPH, RXM_SFRB and RXM_RAW messages plus calculated
        positions and error terms'''
-    def __init__(self):
+    def __init__(self, read_only=False):
         self.azimuth = {}
         self.elevation = {}
         self.lastpos = util.PosVector(0,0,0)
@@ -55,18 +112,36 @@ class SatelliteData:
         # the last position calculated from smoothed pseudo ranges
         self.position_estimate = None
 
-        self.ephemeris = util.loadObject('ephemeris.dat')
-        if self.ephemeris is None:
-            self.ephemeris = {}
-        
-        self.ionospheric = util.loadObject('ionospheric.dat')
-        if self.ionospheric is None:
-            self.ionospheric = {}
+        # every ephemeris seen, and the ones selected for the time of the
+        # last RXM_RAW by svid
+        self.eph_store = ephemeris.EphemerisStore()
+        self.ephemeris = {}
+
+        # the selected ephemerides as a table, for the batch calculations
+        self.eph_table = ephemeris.EphemerisTable()
+
+        self.ionospheric = {}
+
+        # ephemeris and ionospheric subframes are kept in a journal shared
+        # with other processes in the same directory. With read_only the
+        # journal is loaded but the data seen is not added to it
+        self.read_only = read_only
+        self.journal = util.WordJournal(JOURNAL_FILE)
+        self.load_journal()
         self.min_elevation = 5.0
         self.min_quality = 6
 
         self.smooth = prSmooth.prSmooth()
 
+        # the last RXM_RAW pseudo ranges
+        self.raw = None
+
+        self.dispatcher = ublox.UBloxDispatcher()
+        self.dispatcher.subscribe('AID_EPH', self.add_AID_EPH)
+        self.dispatcher.subscribe('RXM_SFRB', self.add_RXM_SFRB)
+        self.dispatcher.subscribe('RXM_RAW', self.add_RXM_RAW)
+        self.dispatcher.subscribe('NAV_POSECEF', self.add_NAV_POSECEF)
+
     def reset(self):
         self.satpos = {}
         self.prMeasured = {}
@@ -85,18 +160,83 @@ class SatelliteData:
             return False
         return True
 
+    def load_journal(self):
+        '''load the ephemerides and ionospheric data from the journal'''
+        if len(self.journal) == 0:
+            self.import_pickles()
+        (kinds, svids, words) = self.journal.load()
+        for eph in journalEphemerides(kinds, svids, words):
+            self.eph_store.add(eph)
+        for (svid, ion_words) in journalIonospheric(kinds, svids, words).items():
+            ion = ephemeris.IonosphericData(journalMessage(JOURNAL_RXM_SFRB, svid, ion_words))
+            if ion.valid:
+                self.ionospheric[svid] = ion
+
+    def import_pickles(self):
+        '''start the journal with the ephemerides and ionospheric data from
+        the ephemeris.dat and ionospheric.dat pickles saved by older
+        versions. A pickle which exists but can't be loaded is an error'''
+        if os.path.exists('ephemeris.dat'):
+            ephs = pickle.load(open('ephemeris.dat', mode='rb'))
+            if isinstance(ephs, dict):
+                ephs = ephs.values()
+            else:
+                ephs = ephs.all()
+            for eph in ephs:
+                self.journal.append(JOURNAL_AID_EPH, eph.svid, pickledWords(eph))
+        if os.path.exists('ionospheric.dat'):
+            ions = pickle.load(open('ionospheric.dat', mode='rb'))
+            for svid in sorted(ions.keys()):
+                if ions[svid].valid:
+                    self.journal.append(JOURNAL_RXM_SFRB, svid, ions[svid].words())
+
+    def append_journal(self, kind, msg):
+        '''append a message to the journal, compacting it once it holds
+        more than twice the records needed'''
+        if self.read_only:
+            return
+        self.journal.append(kind, msg.svid, journalWords(msg))
+        if len(self.journal) > 2 * (len(self.eph_store) + len(self.ionospheric)) + 64:
+            self.journal.compact(self.compact_journal)
+
+    def compact_journal(self, kinds, svids, words):
+        '''return the journal records to keep: the ephemerides an
+        EphemerisStore keeps and the latest ionospheric data for each svid.
+        The journal holds the records from all processes sharing it, so
+        this works from them rather than this object's own data'''
+        store = ephemeris.EphemerisStore(max_per_sv=self.eph_store.max_per_sv,
+                                         max_age=self.eph_store.max_age)
+        for eph in journalEphemerides(kinds, svids, words):
+            store.add(eph)
+        latest_ion = journalIonospheric(kinds, svids, words)
+        ret = [(JOURNAL_AID_EPH, eph.svid, journalWords(eph._msg)) for eph in store.all()]
+        for svid in sorted(latest_ion.keys()):
+            ret.append((JOURNAL_RXM_SFRB, svid, latest_ion[svid]))
+        return ret
+
     def add_AID_EPH(self, msg):
         '''add some AID_EPH ephemeris data'''
         eph = ephemeris.EphemerisData(msg)
-        if eph.valid:
-            if eph.svid in self.ephemeris:
-                old_eph = self.ephemeris[eph.svid]
-            else:
-                old_eph = None
-            self.ephemeris[eph.svid] = eph
-            if old_eph is None or old_eph != eph:
-                self.smooth.reset(eph.svid)
-                util.saveObject('ephemeris.dat', self.ephemeris)
+        if eph.valid and self.eph_store.add(eph):
+            self.append_journal(JOURNAL_AID_EPH, msg)
+            if self.raw is not None:
+                self.select_ephemeris(eph.svid)
+
+    def select_ephemeris(self, svid):
+        '''select the ephemeris for svid at the time of the last RXM_RAW'''
+        eph = self.eph_store.find(svid, self.raw.gps_week, self.raw.time_of_week)
+        old_eph = self.ephemeris.get(svid, None)
+        if eph is None:
+            if old_eph is not None:
+                del self.ephemeris[svid]
+                self.eph_table.discard(svid)
+            return
+        if old_eph is eph:
+            return
+        self.ephemeris[svid] = eph
+        self.eph_table.add(eph.svid, eph.iode, eph)
+        if old_eph is None or old_eph != eph:
+            self.smooth.reset(svid)
 
     def add_RXM_SFRB(self, msg):
         '''add some RXM_SFRB subframe data'''
@@ -108,7 +248,7 @@ class SatelliteData:
                 old_ion = None
             self.ionospheric[msg.svid] = ion
             if old_ion is None or old_ion != ion:
-                util.saveObject('ionospheric.dat', self.ionospheric)
+                self.append_journal(JOURNAL_RXM_SFRB, msg)
 
     def add_RXM_RAW(self, msg):
         '''add some RXM_RAW pseudo range data'''
@@ -120,6 +260,8 @@ class SatelliteData:
                          msg.recs[i].mesQI,
                          msg.recs[i].lli,
                          msg.recs[i].cno)
+        for svid in self.raw.prMeasured:
+            self.select_ephemeris(svid)
         # step the smoothed pseudo-ranges
         self.smooth.step(self.raw)
 
@@ -129,12 +271,5 @@ class SatelliteData:
             
     def add_message(self, msg):
         '''add information from ublox messages'''
-        if msg.name() == 'AID_EPH':
-            self.add_AID_EPH(msg)
-        elif msg.name() == 'RXM_SFRB':
-            self.add_RXM_SFRB(msg)
-        elif msg.name() == 'RXM_RAW':
-            self.add_RXM_RAW(msg)
-        elif msg.name() == 'NAV_POSECEF':
-            self.add_NAV_POSECEF(msg)
+        self.dispatcher.dispatch(msg)
 
@@ -48,15 +48,29 @@ def trimmed_average(a, n):
 
     return out
 
-for log, avg in zip(args, avgs):
-    l = []
+def parse_satlog(log):
+    '''parse a satellite log into a flat array of the measurements of every
+    epoch, and the offset of each epoch's first measurement in it. Epochs
+    need not have the same number of measurements'''
+    meas = []
+    rows = [0]
     with open(log) as f:
         for line in f:
             # Some bug means that huge ranges sometimes get through and stuff the scales.
             # While we search for the bug itself, at least we can stop is messing with the plots
-            meas = [ float(m) if abs(float(m)) < 200 else 0
+            meas += [ float(m) if abs(float(m)) < 200 else 0
                 for m in line.strip().split(',')[1:]] # Cut off the leading timestamp
-            l.append(meas)
+            rows.append(len(meas))
+    return {'meas' : numpy.array(meas, dtype=float), 'rows' : numpy.array(rows, dtype=int)}
+
+def satlog_epochs(arrays):
+    '''return the list of measurements of each epoch from parse_satlog arrays'''
+    meas = arrays['meas'].tolist()
+    rows = arrays['rows'].tolist()
+    return [meas[rows[i]:rows[i+1]] for i in range(len(rows) - 1)]
+
+for log, avg in zip(args, avgs):
+    l = satlog_epochs(util.cachedArrays([log], 'satlog', lambda: parse_satlog(log)))
 
     satlogs.append(l)
 
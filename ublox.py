@@ -9,10 +9,12 @@ Released under GNU GPL version 3 or later
 import struct
 from datetime import datetime
 import time, os
+import multiprocessing, threading, Queue, atexit
 
 # protocol constants
 PREAMBLE1 = 0xB5
 PREAMBLE2 = 0x62
+PREAMBLE  = chr(PREAMBLE1) + chr(PREAMBLE2)
 
 # message classes
 CLASS_NAV = 0x01
@@ -226,6 +228,97 @@ class UBloxAttrDict(dict):
         else:
             self.__setitem__(name, value)
 
+class UBloxRecord(object):
+    '''base class for compact message and record objects. Subclasses are
+    generated per message type with __slots__ for the fields, and allow
+    both attribute and item access'''
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return name in self.__slots__ and hasattr(self, name)
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.items() == other.items()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def keys(self):
+        return [f for f in self.__slots__ if hasattr(self, f)]
+
+    def items(self):
+        return [(f, getattr(self, f)) for f in self.keys()]
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        for (f, v) in state.items():
+            setattr(self, f, v)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join(['%s=%r' % (f, v) for (f, v) in self.items()]))
+
+class UBloxCompactMessage(UBloxRecord):
+    '''base class for compact, unpacked-only copies of messages, created
+    with UBloxMessage.compact()'''
+    __slots__ = ()
+
+    def name(self):
+        '''return the short string name for a message'''
+        return self._name
+
+    def msg_type(self):
+        '''return the message type tuple (class, id)'''
+        return self._msg_type
+
+    def have_field(self, name):
+        '''return True if a message contains the given field'''
+        return name != 'recs' and name in self
+
+_slots_template = '''
+class %(classname)s(%(base)s):
+    __slots__ = %(slots)r
+    def __init__(self, %(args)s):
+%(assign)s
+'''
+
+def MakeSlotsClass(classname, base, fields, extra={}):
+    '''generate a subclass of base with __slots__ for the given fields and
+    an __init__ taking the field values as positional arguments. The class
+    is also added to this module, so its instances can be pickled'''
+    slots = []
+    for f in fields:
+        if not f in slots:
+            slots.append(f)
+    args = ', '.join(['_v%u' % i for i in range(len(fields))])
+    assign = '\n'.join(['        self.%s = _v%u' % (f, i) for (i, f) in enumerate(fields)])
+    if not fields:
+        args = '*args'
+        assign = '        pass'
+    namespace = {}
+    exec(_slots_template % { 'classname' : classname, 'base' : base.__name__,
+                             'slots' : tuple(slots), 'args' : args, 'assign' : assign },
+         globals(), namespace)
+    cls = namespace[classname]
+    for (k, v) in extra.items():
+        setattr(cls, k, v)
+    globals()[classname] = cls
+    return cls
+
 def ArrayParse(field):
     '''parse an array descriptor'''
     arridx = field.find('[')
@@ -235,6 +328,33 @@ def ArrayParse(field):
     fieldname = field[:arridx]
     return (fieldname, alen)
 
+def FormatParse(fmt):
+    '''parse a struct format into its byte order character and a list of
+    per-value format codes, with repeat counts expanded. A string such as
+    30s is a single value. Pad bytes are not supported'''
+    fmt = fmt.replace(' ', '')
+    order = '@'
+    if fmt and fmt[0] in '@=<>!':
+        order = fmt[0]
+        fmt = fmt[1:]
+    codes = []
+    count = ''
+    for c in fmt:
+        if c.isdigit():
+            count += c
+            continue
+        if c in 'sp':
+            codes.append(count + c)
+        else:
+            codes.extend([c] * int(count or 1))
+        count = ''
+    return (order, codes)
+
+# numpy equivalents of struct format codes
+numpy_types = { 'b' : 'i1', 'B' : 'u1', '?' : 'b1', 'c' : 'S1',
+                'h' : 'i2', 'H' : 'u2', 'i' : 'i4', 'I' : 'u4',
+                'q' : 'i8', 'Q' : 'u8', 'f' : 'f4', 'd' : 'f8' }
+
 class UBloxDescriptor:
     '''class used to describe the layout of a UBlox message'''
     def __init__(self, name, msg_format, fields=[], count_field=None, format2=None, fields2=None):
@@ -244,66 +364,246 @@ class UBloxDescriptor:
         self.count_field = count_field
         self.format2 = format2
         self.fields2 = fields2
-	
-    def unpack(self, msg):
-	'''unpack a UBloxMessage, creating the .fields and ._recs attributes in msg'''
-        msg._fields = {}
-
-        # unpack main message blocks. A comm
-        formats = self.msg_format.split(',')
-        buf = msg._buf[6:-2]
-        count = 0
-        msg._recs = []
-        fields = self.fields[:]
-        
-        for fmt in formats:
-            size1 = struct.calcsize(fmt)
-            if size1 > len(buf):
-                raise UBloxError("%s INVALID_SIZE1=%u" % (self.name, len(buf)))
-            f1 = list(struct.unpack(fmt, buf[:size1]))
+        self._compile()
+
+    def _compile(self):
+        '''precompile the layout into struct.Struct objects and a flat
+        field slot plan, so unpack/pack/format do no string parsing'''
+        # one (Struct, slots) entry per comma separated block of
+        # msg_format. Each slot is (fieldname, index, alen), with
+        # alen == -1 for scalar fields
+        self._parsed_fields = [(f, ArrayParse(f)) for f in self.fields]
+        self._blocks = []
+        fidx = 0
+        for fmt in self.msg_format.split(','):
+            s = struct.Struct(fmt)
+            nvalues = len(s.unpack('\0' * s.size))
+            slots = []
             i = 0
-            while i < len(f1):
-                field = fields.pop(0)
-                (fieldname, alen) = ArrayParse(field)
+            while i < nvalues:
+                (f, (fieldname, alen)) = self._parsed_fields[fidx]
+                slots.append((fieldname, i, alen))
+                fidx += 1
                 if alen == -1:
-                    msg._fields[fieldname] = f1[i]
-                    if self.count_field == fieldname:
-                        count = int(f1[i])
                     i += 1
                 else:
-                    msg._fields[fieldname] = [0]*alen
-                    for a in range(alen):
-                        msg._fields[fieldname][a] = f1[i]
-                        i += 1
-            buf = buf[size1:]
-            if len(buf) == 0:
+                    i += alen
+            self._blocks.append((s, slots))
+        # offset within the payload of each field of the main blocks, for
+        # direct access to single fields
+        self._field_offsets = {}
+        ofs = 0
+        for (s, slots) in self._blocks:
+            for (fieldname, fs, fofs, alen) in self._layout(s, slots):
+                self._field_offsets[fieldname] = (fs, ofs + fofs, alen)
+            ofs += s.size
+        self._full_struct = struct.Struct(self.msg_format.replace(',', ''))
+        self._first_struct = self._blocks[0][0]
+        self._struct2 = None
+        if self.format2 is not None:
+            self._struct2 = struct.Struct(self.format2)
+        self._dtype = None
+        self._dtype2 = None
+
+        # compact classes for records and unpacked messages
+        self._record_class = None
+        if self.fields2 is not None:
+            self._record_class = MakeSlotsClass('UBloxRecord_' + self.name, UBloxRecord,
+                                                self.fields2)
+        names = [fieldname for (f, (fieldname, alen)) in self._parsed_fields]
+        self._compact_fields = names
+        self._compact_class = MakeSlotsClass('UBloxCompact_' + self.name, UBloxCompactMessage,
+                                             names + ['recs'], { '_name' : self.name })
+
+    def _layout(self, s, slots):
+        '''return (fieldname, Struct, offset, alen) for each slot of a block'''
+        (order, codes) = FormatParse(s.format)
+        ret = []
+        for (fieldname, i, alen) in slots:
+            fmt = ''.join(codes[i:i+max(alen, 1)])
+            ofs = struct.calcsize(order + ''.join(codes[:i]) + fmt) - struct.calcsize(order + fmt)
+            ret.append((fieldname, struct.Struct(order + fmt), ofs, alen))
+        return ret
+
+    def _make_dtype(self, s, slots):
+        '''return a numpy structured dtype matching a block layout'''
+        import numpy
+        fields = {}
+        for (fieldname, fs, ofs, alen) in self._layout(s, slots):
+            (order, codes) = FormatParse(fs.format)
+            code = codes[0]
+            if code[-1] == 's':
+                t = 'S' + code[:-1]
+            else:
+                t = {'@' : '=', '=' : '=', '<' : '<', '>' : '>', '!' : '>'}[order]
+                t += numpy_types[code]
+            if alen == -1:
+                fields[fieldname] = (numpy.dtype(t), ofs)
+            else:
+                fields[fieldname] = (numpy.dtype((t, alen)), ofs)
+        # repeated names keep the last occurrence, as in unpack()
+        names = sorted(fields.keys(), key=lambda f: fields[f][1])
+        return numpy.dtype({'names' : names,
+                            'formats' : [fields[f][0] for f in names],
+                            'offsets' : [fields[f][1] for f in names],
+                            'itemsize' : s.size})
+
+    def dtype(self):
+        '''return the numpy dtype of the first (mandatory) block'''
+        if self._dtype is None:
+            (s, slots) = self._blocks[0]
+            self._dtype = self._make_dtype(s, slots)
+        return self._dtype
+
+    def dtype2(self):
+        '''return the numpy dtype of the repeated block'''
+        if self._struct2 is None:
+            raise UBloxError("%s has no repeated block" % self.name)
+        if self._dtype2 is None:
+            slots = [(f, i, -1) for (i, f) in enumerate(self.fields2)]
+            self._dtype2 = self._make_dtype(self._struct2, slots)
+        return self._dtype2
+
+    def _recs_offset(self, length):
+        '''return the payload offset of the repeated block for a payload length'''
+        ofs = 0
+        for (s, slots) in self._blocks:
+            ofs += s.size
+            if ofs >= length:
+                break
+        return ofs
+
+    def recs_array(self, msg):
+        '''return the repeated block of a message as a numpy structured array,
+        viewing the message buffer directly'''
+        import numpy
+        dtype2 = self.dtype2()
+        length = len(msg._buf) - 8
+        ofs = self._recs_offset(length)
+        if self.count_field == '_remaining':
+            count = (length - ofs) // dtype2.itemsize
+        else:
+            (fs, fofs, alen) = self._field_offsets[self.count_field]
+            (count,) = fs.unpack_from(msg._buf, 6 + fofs)
+        if ofs + count * dtype2.itemsize != length:
+            raise UBloxError("%s INVALID_SIZE=%u" % (self.name, length))
+        return numpy.frombuffer(msg._buf, dtype2, count, 6 + ofs)
+
+    def table(self, frames, offsets=None):
+        '''decode a sequence of complete frames of this message type into a
+        single numpy structured array.
+
+        For messages with a repeated block there is one row per record,
+        with the scalar fields of the message header repeated into each
+        row. Otherwise there is one row per message, holding the fields of
+        the first block. Frames which are too short, or whose record count
+        does not match their length, are skipped. If the file offsets of
+        the frames are given they are added as an _offset column.
+        '''
+        import numpy
+        dtype = self.dtype()
+        hsize = dtype.itemsize
+        if offsets is None:
+            offsets = [0] * len(frames)
+            add_offsets = False
+        else:
+            add_offsets = True
+        keep = [len(f) >= hsize + 8 for f in frames]
+        frames = [f for (f, k) in zip(frames, keep) if k]
+        offsets = numpy.array([o for (o, k) in zip(offsets, keep) if k], dtype=numpy.int64)
+        lengths = numpy.array([len(f) - 8 for f in frames], dtype=numpy.int64)
+        hdr = numpy.frombuffer(''.join([f[6:6+hsize] for f in frames]), dtype, len(frames))
+        if self._struct2 is None:
+            if not add_offsets:
+                return hdr.copy()
+            counts = numpy.ones(len(frames), dtype=numpy.int64)
+            recs = None
+            dtype2 = numpy.dtype([])
+        else:
+            if len(self._blocks) != 1:
+                raise UBloxError("%s has optional blocks before its repeated block" % self.name)
+            dtype2 = self.dtype2()
+            if self.count_field == '_remaining':
+                counts = (lengths - hsize) // dtype2.itemsize
+            else:
+                counts = hdr[self.count_field].astype(numpy.int64)
+            ok = (hsize + counts * dtype2.itemsize == lengths)
+            frames = [f for (f, k) in zip(frames, ok) if k]
+            hdr = hdr[ok]
+            counts = counts[ok]
+            offsets = offsets[ok]
+            recs = numpy.frombuffer(''.join([f[6+hsize:-2] for f in frames]), dtype2, int(counts.sum()))
+
+        if recs is None:
+            # one row per message, all header fields
+            hnames = list(dtype.names)
+        else:
+            # header scalar fields come first, unless a record field shares the name
+            hnames = [f for f in dtype.names if not f in dtype2.fields and dtype.fields[f][0].shape == ()]
+        ocolumn = []
+        if add_offsets:
+            ocolumn = [('_offset', numpy.int64)]
+        out = numpy.zeros(int(counts.sum()), dtype=[(f, dtype.fields[f][0]) for f in hnames] +
+                                                   [(f, dtype2.fields[f][0]) for f in dtype2.names] +
+                                                   ocolumn)
+        for f in hnames:
+            out[f] = numpy.repeat(hdr[f], counts)
+        if recs is not None:
+            for f in dtype2.names:
+                out[f] = recs[f]
+        if add_offsets:
+            out['_offset'] = numpy.repeat(offsets, counts)
+        return out
+
+    def unpack(self, msg):
+        '''unpack a UBloxMessage, creating the .fields and ._recs attributes in msg'''
+        msg._lazy = False
+        msg._fields = fields = {}
+        msg._recs = recs = []
+
+        # unpack main message blocks. A comma in the format marks the
+        # start of an optional block
+        buf = msg._buf
+        ofs = 6
+        end = len(buf) - 2
+        count = 0
+        for (s, slots) in self._blocks:
+            if s.size > end - ofs:
+                raise UBloxError("%s INVALID_SIZE1=%u" % (self.name, end - ofs))
+            f1 = s.unpack_from(buf, ofs)
+            for (fieldname, i, alen) in slots:
+                if alen == -1:
+                    fields[fieldname] = f1[i]
+                else:
+                    fields[fieldname] = list(f1[i:i+alen])
+            ofs += s.size
+            if ofs == end:
                 break
 
         if self.count_field == '_remaining':
-            count = len(buf) / struct.calcsize(self.format2)
+            count = (end - ofs) // self._struct2.size
+        elif self.count_field is not None:
+            count = int(fields.get(self.count_field, 0))
 
         if count == 0:
             msg._unpacked = True
-            if len(buf) != 0:
-                raise UBloxError("EXTRA_BYTES=%u" % len(buf))
+            if ofs != end:
+                raise UBloxError("EXTRA_BYTES=%u" % (end - ofs))
             return
 
-        size2 = struct.calcsize(self.format2)
+        s2 = self._struct2
+        record = self._record_class
         for c in range(count):
-            r = UBloxAttrDict()
-            if size2 > len(buf):
-                raise UBloxError("INVALID_SIZE=%u, " % len(buf))
-            f2 = list(struct.unpack(self.format2, buf[:size2]))
-            for i in range(len(self.fields2)):
-                r[self.fields2[i]] = f2[i]
-            buf = buf[size2:]
-            msg._recs.append(r)
-        if len(buf) != 0:
-            raise UBloxError("EXTRA_BYTES=%u" % len(buf))
+            if s2.size > end - ofs:
+                raise UBloxError("INVALID_SIZE=%u, " % (end - ofs))
+            recs.append(record(*s2.unpack_from(buf, ofs)))
+            ofs += s2.size
+        if ofs != end:
+            raise UBloxError("EXTRA_BYTES=%u" % (end - ofs))
         msg._unpacked = True
 
     def pack(self, msg, msg_class=None, msg_id=None):
-	'''pack a UBloxMessage from the .fields and ._recs attributes in msg'''
+        '''pack a UBloxMessage from the .fields and ._recs attributes in msg'''
         f1 = []
         if msg_class is None:
             msg_class = msg.msg_class()
@@ -311,45 +611,52 @@ class UBloxDescriptor:
             msg_id = msg.msg_id()
         msg._buf = ''
 
-        fields = self.fields[:]
-        for f in fields:
-            (fieldname, alen) = ArrayParse(f)
+        for (f, (fieldname, alen)) in self._parsed_fields:
             if not fieldname in msg._fields:
                 break
             if alen == -1:
                 f1.append(msg._fields[fieldname])
             else:
-                for a in range(alen):
-                    f1.append(msg._fields[fieldname][a])                    
+                f1.extend(msg._fields[fieldname][:alen])
         try:
             # try full length message
-            fmt = self.msg_format.replace(',', '')
-            msg._buf = struct.pack(fmt, *tuple(f1))
+            msg._buf = self._full_struct.pack(*f1)
         except Exception as e:
             # try without optional part
-            fmt = self.msg_format.split(',')[0]
-            msg._buf = struct.pack(fmt, *tuple(f1))
+            msg._buf = self._first_struct.pack(*f1)
 
         length = len(msg._buf)
         if msg._recs:
-            length += len(msg._recs) * struct.calcsize(self.format2)
+            length += len(msg._recs) * self._struct2.size
         header = struct.pack('<BBBBH', PREAMBLE1, PREAMBLE2, msg_class, msg_id, length)
         msg._buf = header + msg._buf
 
-        for r in msg._recs:
-            f2 = []
-            for f in self.fields2:
-                f2.append(r[f])
-            msg._buf += struct.pack(self.format2, *tuple(f2))            
-        msg._buf += struct.pack('<BB', *msg.checksum(data=msg._buf[2:]))
+        if msg._recs:
+            s2 = self._struct2
+            fields2 = self.fields2
+            msg._buf += ''.join([s2.pack(*[r[f] for f in fields2]) for r in msg._recs])
+        msg._buf += struct.pack('<BB', *ubx_checksum(msg._buf, 2))
+
+    def compact(self, msg):
+        '''return a compact copy of an unpacked message, using the
+        generated __slots__ class for this message type'''
+        if not msg._unpacked:
+            self.unpack(msg)
+        fields = msg._fields
+        # optional fields which are not present are left unset
+        c = self._compact_class.__new__(self._compact_class)
+        for f in self._compact_fields:
+            if f in fields:
+                setattr(c, f, fields[f])
+        c.recs = tuple(msg._recs)
+        return c
 
     def format(self, msg):
-	'''return a formatted string for a message'''
+        '''return a formatted string for a message'''
         if not msg._unpacked:
             self.unpack(msg)
         ret = self.name + ': '
-        for f in self.fields:
-            (fieldname, alen) = ArrayParse(f)
+        for (f, (fieldname, alen)) in self._parsed_fields:
             if not fieldname in msg._fields:
                 continue
             v = msg._fields[fieldname]
@@ -369,7 +676,7 @@ class UBloxDescriptor:
                 ret += '%s=%s, ' % (f, v)
             ret = ret[:-2] + ' ], '
         return ret[:-2]
-        
+
 
 # list of supported message types.
 msg_types = {
@@ -392,7 +699,7 @@ msg_types = {
                                                   ['clearMask', 'saveMask', 'loadMask', 'deviceMask']),
     (CLASS_CFG, MSG_CFG_RST)    : UBloxDescriptor('CFG_RST',
                                                   '<HBB',
-                                                  ['navBbrMask ', 'resetMode', 'reserved1']),
+                                                  ['navBbrMask', 'resetMode', 'reserved1']),
     (CLASS_NAV, MSG_NAV_POSLLH) : UBloxDescriptor('NAV_POSLLH',
                                                   '<IiiiiII', 
                                                   ['iTOW', 'Longitude', 'Latitude', 'height', 'hMSL', 'hAcc', 'vAcc']),
@@ -476,7 +783,8 @@ msg_types = {
                                                   ['chn', 'svid', 'dwrd[10]']),
     (CLASS_AID, MSG_AID_ALM)   : UBloxDescriptor('AID_ALM',
                                                   '<II',
-                                                 '_remaining',
+                                                  ['svid', 'week'],
+                                                  '_remaining',
                                                  'I',
                                                  ['dwrd']),
     (CLASS_RXM, MSG_RXM_ALM)   : UBloxDescriptor('RXM_ALM',
@@ -525,14 +833,305 @@ msg_types = {
                                                    'obs', 'valid', 'active', 'reserved1'])
 }
 
+for (msg_type, desc) in msg_types.items():
+    desc._compact_class._msg_type = msg_type
+del msg_type, desc
+
+def message_types(names):
+    '''return the set of (class, id) message types whose names match any
+    of a list of names, which may contain shell style wildcards'''
+    import fnmatch
+    ret = set()
+    for (msg_type, desc) in msg_types.items():
+        for n in names:
+            if fnmatch.fnmatch(desc.name, n):
+                ret.add(msg_type)
+    return ret
+
+
+# weight table for the numpy checksum path. ck_b is the sum of the running
+# ck_a values, which is the data weighted by (n - i)
+_checksum_weights = None
+
+# the longest range a frame checksum covers: class, id, length and a
+# payload of up to 65535 bytes
+CHECKSUM_MAX_LENGTH = 4 + 0xFFFF
+
+# below this many bytes the plain loop is faster than going through numpy
+CHECKSUM_NUMPY_MIN = 128
+
+def ubx_checksum(data, start=0, end=None):
+    '''return the UBX checksum tuple (ck_a, ck_b) of data[start:end]
+
+    data may be a str, bytearray or mmap. Long ranges are summed with a
+    precomputed weight table in numpy when it is available.
+    '''
+    global _checksum_weights
+    if end is None:
+        end = len(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    n = end - start
+    if n >= CHECKSUM_NUMPY_MIN:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            if _checksum_weights is None or len(_checksum_weights) < n:
+                _checksum_weights = numpy.arange(max(n, CHECKSUM_MAX_LENGTH), 0, -1, dtype=numpy.uint32)
+            d = numpy.frombuffer(data, numpy.uint8, n, start)
+            return (int(d.sum()) & 0xFF,
+                    int(numpy.dot(d, _checksum_weights[-n:])) & 0xFF)
+    ck_a = 0
+    ck_b = 0
+    for i in bytearray(data[start:end]):
+        ck_a = (ck_a + i) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return (ck_a, ck_b)
+
+def ubx_checksum_batch(data, starts, ends, chunk_size=1<<22):
+    '''return numpy arrays (ck_a, ck_b) holding the UBX checksum of each
+    range data[starts[i]:ends[i]]. starts must be in ascending order.
+
+    Each ck_a is a difference of a cumulative byte sum and each ck_b
+    follows from a cumulative index weighted sum, so a whole batch costs
+    a couple of vector passes over the data. The passes are done in
+    chunks of about chunk_size bytes to bound memory use.
+    '''
+    import numpy
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ends = numpy.asarray(ends, dtype=numpy.int64)
+    ck_a = numpy.zeros(len(starts), dtype=numpy.uint8)
+    ck_b = numpy.zeros(len(starts), dtype=numpy.uint8)
+    i = 0
+    while i < len(starts):
+        j = int(numpy.searchsorted(starts, starts[i] + chunk_size, 'right'))
+        j = max(j, i+1)
+        lo = int(starts[i])
+        hi = int(ends[i:j].max())
+        d = numpy.frombuffer(data, numpy.uint8, hi-lo, lo).astype(numpy.uint64)
+        # all sums are modulo 2**64, which preserves them modulo 256
+        s1 = numpy.zeros(len(d)+1, dtype=numpy.uint64)
+        numpy.cumsum(d, out=s1[1:])
+        s2 = numpy.zeros(len(d)+1, dtype=numpy.uint64)
+        numpy.cumsum(d * numpy.arange(len(d), dtype=numpy.uint64), out=s2[1:])
+        s = (starts[i:j] - lo).astype(numpy.uint64)
+        e = (ends[i:j] - lo).astype(numpy.uint64)
+        a = s1[e] - s1[s]
+        b = e * a - (s2[e] - s2[s])
+        ck_a[i:j] = a & 0xFF
+        ck_b[i:j] = b & 0xFF
+        i = j
+    return (ck_a, ck_b)
+
+def ubx_verify_frames(data, offsets):
+    '''return a numpy boolean array which is True where a complete UBX frame
+    with a valid checksum starts at the matching entry of offsets'''
+    import numpy
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+    d = numpy.frombuffer(data, numpy.uint8)
+    ok = (offsets >= 0) & (offsets + 8 <= len(d))
+    o = offsets[ok]
+    lengths = d[o+4].astype(numpy.int64) | (d[o+5].astype(numpy.int64) << 8)
+    ends = o + lengths + 8
+    inside = ends <= len(d)
+    ok[ok] = inside
+    o = o[inside]
+    ends = ends[inside]
+    if len(o) == 0:
+        return ok
+    (ck_a, ck_b) = ubx_checksum_batch(data, o+2, ends-2)
+    ok[ok] = (ck_a == d[ends-2]) & (ck_b == d[ends-1])
+    return ok
+
+
+def ubx_find_frames(data, start=0, end=None, chunk_size=1<<24):
+    '''return numpy arrays of the offsets and payload lengths of all
+    complete frames with valid checksums starting in data[start:end]. Frames
+    may extend past end. Candidates may overlap, see ubx_chain_frames()'''
+    import numpy
+    d = numpy.frombuffer(data, numpy.uint8)
+    if end is None:
+        end = len(d)
+    offsets = []
+    lengths = []
+    for lo in range(start, end, chunk_size):
+        hi = min(lo + chunk_size, end)
+        c = d[lo:min(hi + 1, len(d))]
+        cand = numpy.flatnonzero((c[:-1] == PREAMBLE1) & (c[1:] == PREAMBLE2)) + lo
+        cand = cand[ubx_verify_frames(data, cand)]
+        offsets.append(cand)
+        lengths.append(d[cand+4].astype(numpy.int64) | (d[cand+5].astype(numpy.int64) << 8))
+    if not offsets:
+        return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64))
+    return (numpy.concatenate(offsets), numpy.concatenate(lengths))
+
+def ubx_chain_frames(offsets, lengths, pos=0):
+    '''follow the chain of frames from ubx_find_frames(), skipping
+    candidates at or after pos which lie inside the previous frame. Returns
+    a numpy array of the offsets of the frames kept'''
+    import numpy
+    ret = []
+    for (o, length) in zip(offsets.tolist(), lengths.tolist()):
+        if o >= pos:
+            ret.append(o)
+            pos = o + length + 8
+    return numpy.array(ret, dtype=numpy.int64)
+
+def _time_fields():
+    '''return a dictionary mapping message type to the struct and payload
+    offsets of its iTOW and week fields (None if absent), for the message
+    types which carry iTOW'''
+    ret = {}
+    for (type, desc) in msg_types.items():
+        if not 'iTOW' in desc._field_offsets:
+            continue
+        (s, fofs, alen) = desc._field_offsets['iTOW']
+        week = desc._field_offsets.get('week', None)
+        if week is not None:
+            week = (week[0], week[1])
+        ret[type] = ((s, fofs), week)
+    return ret
+
+def ubx_frame_times(data, start=0, end=None, window=1<<17):
+    '''generate (offset, week, iTOW) for the frames in data[start:end]
+    which carry an iTOW field. Messages without a week field are given
+    the week of the last message which had one, or -1 if none has yet
+    been seen'''
+    fields = _time_fields()
+    if end is None:
+        end = len(data)
+    week = -1
+    pos = start
+    while pos < end:
+        hi = min(pos + window, end)
+        (cand, lengths) = ubx_find_frames(data, pos, hi)
+        offsets = ubx_chain_frames(cand, lengths, pos)
+        for o in offsets.tolist():
+            (msg_class, msg_id, length) = struct.unpack_from('<BBH', data, o+2)
+            f = fields.get((msg_class, msg_id), None)
+            if f is None:
+                continue
+            ((s, fofs), wf) = f
+            if length < fofs + s.size:
+                continue
+            itow = s.unpack_from(data, o+6+fofs)[0]
+            if wf is not None and length >= wf[1] + wf[0].size:
+                week = wf[0].unpack_from(data, o+6+wf[1])[0]
+            yield (o, week, itow)
+        if len(offsets) == 0:
+            pos = hi
+        else:
+            # continue from the end of the last frame found
+            o = int(offsets[-1])
+            pos = max(hi, o + struct.unpack_from('<H', data, o+4)[0] + 8)
+
+def _time_key(week, itow):
+    '''return a sortable time in milliseconds. week is None to compare
+    time of week only'''
+    if week is None:
+        return itow
+    return week * 604800000 + itow
+
+def ubx_find_time(data, week, tow, window=1<<17):
+    '''return the offset of the first frame in data at or after GPS week
+    and time of week tow (in seconds), found by bisection, or len(data)
+    if there is none. If week is None only the time of week is compared'''
+    target = _time_key(week, int(round(tow * 1000)))
+
+    def probe(ofs):
+        '''return (offset, time) of the first timed frame at or after ofs'''
+        for (o, w, itow) in ubx_frame_times(data, ofs, window=window):
+            if week is None:
+                return (o, itow)
+            if w != -1:
+                return (o, _time_key(w, itow))
+        return (len(data), None)
+
+    lo = 0
+    hi = len(data)
+    while hi - lo > window:
+        mid = (lo + hi) // 2
+        (o, t) = probe(mid)
+        if t is None or t >= target:
+            hi = mid
+        else:
+            lo = o + 1
+    # the first timed frame after lo may lack a week, so start the final
+    # scan one window back to pick one up
+    for (o, w, itow) in ubx_frame_times(data, max(0, lo - window), window=window):
+        if o < lo:
+            continue
+        if week is None:
+            t = itow
+        elif w == -1:
+            continue
+        else:
+            t = _time_key(w, itow)
+        if t >= target:
+            return o
+    return len(data)
+
+def _parallel_open(filename):
+    '''memory map a log file in a worker process'''
+    import mmap
+    f = open(filename, mode='rb')
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f.close()
+    return data
+
+def _parallel_find_frames(args):
+    '''worker for UBloxLogIndex: ubx_find_frames() on one byte range'''
+    (filename, start, end) = args
+    data = _parallel_open(filename)
+    ret = ubx_find_frames(data, start, end)
+    data.close()
+    return ret
+
+def _parallel_table(args):
+    '''worker for UBloxLogIndex.parallel_tables(): decode frames of one type'''
+    (filename, type, offsets, lengths) = args
+    data = _parallel_open(filename)
+    frames = [data[o:o+l+8] for (o, l) in zip(offsets.tolist(), lengths.tolist())]
+    data.close()
+    return msg_types[type].table(frames)
+
+def _parallel_messages(args):
+    '''worker for UBloxLogIndex.parallel_messages(): unpack a batch of frames'''
+    (filename, offsets, lengths) = args
+    data = _parallel_open(filename)
+    ret = []
+    for (o, l) in zip(offsets.tolist(), lengths.tolist()):
+        msg = UBloxMessage()
+        msg._buf = data[o:o+l+8]
+        msg._checksum_ok = True
+        try:
+            msg.unpack()
+        except UBloxError:
+            pass
+        ret.append(msg)
+    data.close()
+    return ret
 
 class UBloxMessage:
     '''UBlox message class - holds a UBX binary message'''
+
+    # unpack counters shared by all messages, see UBlox.stats()
+    unpack_count = 0
+    unpack_time = 0.0
+
+    # defaults for messages not made by __init__, such as unpickled ones
+    _lazy = False
+    _checksum_ok = None
+
     def __init__(self):
         self._buf = ""
         self._fields = {}
         self._recs = []
         self._unpacked = False
+        self._lazy = False
+        self._checksum_ok = None
         self.debug_level = 0
 
     def __str__(self):
@@ -546,22 +1145,63 @@ class UBloxMessage:
 
     def __getattr__(self, name):
         '''allow access to message fields'''
+        if name.startswith('_'):
+            raise AttributeError(name)
         try:
             return self._fields[name]
         except KeyError:
             if name == 'recs':
+                if self._lazy:
+                    self._unpack_all()
                 return self._recs
+            if self._lazy:
+                return self._unpack_field(name)
             raise AttributeError(name)
 
     def __setattr__(self, name, value):
         '''allow access to message fields'''
         if name.startswith('_'):
             self.__dict__[name] = value
+            if name == '_buf':
+                # the cached checksum result no longer applies
+                self.__dict__['_checksum_ok'] = None
         else:
+            if self._lazy:
+                self._unpack_all()
             self._fields[name] = value
 
+    def _unpack_field(self, name):
+        '''decode a single field of a lazily unpacked message'''
+        desc = msg_types[self.msg_type()]
+        try:
+            (s, ofs, alen) = desc._field_offsets[name]
+        except KeyError:
+            raise AttributeError(name)
+        if 6 + ofs + s.size > len(self._buf) - 2:
+            # an optional field which is not present
+            raise AttributeError(name)
+        v = s.unpack_from(self._buf, 6 + ofs)
+        if alen == -1:
+            v = v[0]
+        else:
+            v = list(v)
+        self._fields[name] = v
+        return v
+
+    def _unpack_all(self):
+        '''complete the unpack of a lazily unpacked message'''
+        t0 = time.time()
+        msg_types[self.msg_type()].unpack(self)
+        UBloxMessage.unpack_count += 1
+        UBloxMessage.unpack_time += time.time() - t0
+
     def have_field(self, name):
         '''return True if a message contains the given field'''
+        if self._lazy and not name in self._fields:
+            try:
+                self._unpack_field(name)
+            except AttributeError:
+                return False
         return name in self._fields
 
     def debug(self, level, msg):
@@ -569,14 +1209,49 @@ class UBloxMessage:
         if self.debug_level >= level:
             print(msg)
 
-    def unpack(self):
-	'''unpack a message'''
+    def unpack(self, lazy=False):
+	'''unpack a message.
+
+        With lazy=True fields of messages with repeated or optional
+        blocks are decoded one at a time as they are accessed, straight
+        from the message buffer. The full unpack (and its size checks)
+        only happens when the records, a field update, pack() or
+        formatting need it. Single block messages are always unpacked in
+        full, as that is one struct call.
+        '''
         if not self.valid():
             raise UBloxError('INVALID MESSAGE')
         type = self.msg_type()
         if not type in msg_types:
             raise UBloxError('Unknown message %s length=%u' % (str(type), len(self._buf)))
-        msg_types[type].unpack(self)
+        desc = msg_types[type]
+        if lazy and (desc.format2 is not None or len(desc._blocks) > 1):
+            if not self._unpacked:
+                self._lazy = True
+            return
+        t0 = time.time()
+        desc.unpack(self)
+        UBloxMessage.unpack_count += 1
+        UBloxMessage.unpack_time += time.time() - t0
+
+    def recs_array(self):
+	'''return the repeated block of a message as a numpy structured array'''
+        if not self.valid():
+            raise UBloxError('INVALID MESSAGE')
+        type = self.msg_type()
+        if not type in msg_types:
+            raise UBloxError('Unknown message %s' % str(type))
+        return msg_types[type].recs_array(self)
+
+    def compact(self):
+	'''return a compact copy of the unpacked message, without its buffer.
+        The copy keeps attribute access to fields and records'''
+        if not self.valid():
+            raise UBloxError('INVALID MESSAGE')
+        type = self.msg_type()
+        if not type in msg_types:
+            raise UBloxError('Unknown message %s' % str(type))
+        return msg_types[type].compact(self)
 
     def pack(self):
 	'''pack a message'''
@@ -585,6 +1260,8 @@ class UBloxMessage:
         type = self.msg_type()
         if not type in msg_types:
             raise UBloxError('Unknown message %s' % str(type))
+        if self._lazy:
+            self._unpack_all()
         msg_types[type].pack(self)
 
     def name(self):
@@ -632,29 +1309,30 @@ class UBloxMessage:
 	'''add some bytes to a message'''
         self._buf += bytes
         while not self.valid_so_far() and len(self._buf) > 0:
-	    '''handle corrupted streams'''
-            self._buf = self._buf[1:]
+	    '''handle corrupted streams, jumping to the next preamble'''
+            idx = self._buf.find(PREAMBLE, 1)
+            if idx == -1:
+                if self._buf[-1] == chr(PREAMBLE1):
+                    idx = len(self._buf) - 1
+                else:
+                    idx = len(self._buf)
+            self._buf = self._buf[idx:]
         if self.needed_bytes() < 0:
             self._buf = ""
 
     def checksum(self, data=None):
 	'''return a checksum tuple for a message'''
         if data is None:
-            data = self._buf[2:-2]
-        cs = 0
-        ck_a = 0
-        ck_b = 0
-        for i in data:
-            ck_a = (ck_a + ord(i)) & 0xFF
-            ck_b = (ck_b + ck_a) & 0xFF
-        return (ck_a, ck_b)
+            return ubx_checksum(self._buf, 2, len(self._buf)-2)
+        return ubx_checksum(data)
 
     def valid_checksum(self):
-	'''check if the checksum is OK'''
-        (ck_a, ck_b) = self.checksum()
-        d = self._buf[2:-2]
-        (ck_a2, ck_b2) = struct.unpack('<BB', self._buf[-2:])
-        return ck_a == ck_a2 and ck_b == ck_b2
+	'''check if the checksum is OK. The result is cached until _buf changes'''
+        if self._checksum_ok is None:
+            (ck_a, ck_b) = self.checksum()
+            (ck_a2, ck_b2) = struct.unpack('<BB', self._buf[-2:])
+            self._checksum_ok = (ck_a == ck_a2 and ck_b == ck_b2)
+        return self._checksum_ok
 
     def needed_bytes(self):
         '''return number of bytes still needed'''
@@ -667,6 +1345,585 @@ class UBloxMessage:
         return len(self._buf) >= 8 and self.needed_bytes() == 0 and self.valid_checksum()
 
 
+class UBloxDispatcher:
+    '''fan messages out to the handlers registered for their type.
+
+    Handlers are registered by (class, id) or by name and kept in a
+    dictionary keyed by the integer (class << 8) | id, so dispatch does no
+    name lookups. Each message is unpacked at most once, fully if any
+    handler of its type asked for that, otherwise lazily if any asked for
+    that, before being passed to each handler in registration order.
+    '''
+    UNPACK_NONE = 0
+    UNPACK_LAZY = 1
+    UNPACK_FULL = 2
+
+    def __init__(self):
+        self.handlers = {}
+
+    def _keys(self, types):
+        '''return the integer keys of a type, a name, or a list of either'''
+        if isinstance(types, (str, tuple)):
+            types = [types]
+        ret = []
+        for t in types:
+            if isinstance(t, str):
+                matches = [k for (k, d) in msg_types.items() if d.name == t]
+                if not matches:
+                    raise UBloxError('Unknown message name %s' % t)
+                t = matches[0]
+            ret.append((t[0] << 8) | t[1])
+        return ret
+
+    def subscribe(self, types, handler, unpack=UNPACK_FULL):
+        '''call handler(msg) for messages of a (class, id) type, a message
+        name, or a list of either'''
+        for key in self._keys(types):
+            entry = self.handlers.setdefault(key, [self.UNPACK_NONE, []])
+            entry[0] = max(entry[0], unpack)
+            entry[1].append(handler)
+
+    def unsubscribe(self, types, handler):
+        '''remove a handler'''
+        for key in self._keys(types):
+            entry = self.handlers.get(key, None)
+            if entry is not None and handler in entry[1]:
+                entry[1].remove(handler)
+
+    def dispatch(self, msg):
+        '''pass a message to its handlers, returning True if it had any'''
+        b = msg._buf
+        entry = self.handlers.get((ord(b[2]) << 8) | ord(b[3]), None)
+        if entry is None or not entry[1]:
+            return False
+        (unpack, handlers) = entry
+        if unpack != self.UNPACK_NONE and not msg._unpacked:
+            if unpack == self.UNPACK_FULL:
+                if msg._lazy:
+                    msg._unpack_all()
+                else:
+                    msg.unpack()
+            elif not msg._lazy:
+                msg.unpack(lazy=True)
+        for h in handlers:
+            h(msg)
+        return True
+
+
+class UBloxFramer:
+    '''incremental framer for a stream of UBX bytes
+
+    bytes are accumulated in a bytearray and complete frames are
+    returned as memoryview slices of it, without copying. A frame is
+    only valid until the next call to add(). Resync after corruption
+    jumps straight to the next preamble rather than dropping one byte
+    at a time.
+    '''
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+        self._needed = 8
+        self._skip = 0
+        self.debug_level = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        '''zero the framing counters'''
+        self.frame_counts = {}
+        self.frames_skipped = 0
+        self.checksum_failures = 0
+        self.bytes_discarded = 0
+
+    def debug(self, level, msg):
+        '''write a debug message'''
+        if self.debug_level >= level:
+            print(msg)
+
+    def reset(self):
+        '''discard all buffered data'''
+        self._buf = bytearray()
+        self._pos = 0
+        self._needed = 8
+        self._skip = 0
+
+    def add(self, data):
+        '''add some bytes from the stream'''
+        if self._skip > 0:
+            # the rest of a frame being skipped
+            n = min(self._skip, len(data))
+            self._skip -= n
+            data = data[n:]
+        if self._pos > 0:
+            # frames handed out as memoryviews still reference the old
+            # buffer, so start a new one rather than resizing in place
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        self._buf += data
+
+    def buffered(self):
+        '''return number of bytes buffered but not yet framed'''
+        return len(self._buf) - self._pos
+
+    def needed_bytes(self):
+        '''return number of bytes needed to complete the current frame'''
+        return self._skip + self._needed
+
+    def next_frame(self, types=None, verify=True):
+        '''return the next complete frame as a memoryview, or None if more
+        data is needed.
+
+        If types is a set of (class, id) tuples, frames of other types are
+        dropped without being returned. With verify=False they are skipped
+        on the strength of their length field alone, without waiting for
+        or checksumming their payload; skip_pending() then gives the
+        number of stream bytes still to be skipped.
+        '''
+        buf = self._buf
+        n = len(buf)
+        pos = self._pos
+        while True:
+            idx = buf.find(PREAMBLE, pos)
+            if idx == -1:
+                # keep a trailing PREAMBLE1, it may start the next frame
+                if n > pos and buf[n-1] == PREAMBLE1:
+                    idx = n - 1
+                else:
+                    idx = n
+                self.bytes_discarded += idx - pos
+                self._pos = idx
+                self._needed = 8 - (n - idx)
+                return None
+            self.bytes_discarded += idx - pos
+            pos = idx
+            if n - pos < 8:
+                self._pos = pos
+                self._needed = 8 - (n - pos)
+                return None
+            (msg_class, msg_id, length) = struct.unpack_from('<BBH', buf, pos+2)
+            end = pos + length + 8
+            wanted = types is None or (msg_class, msg_id) in types
+            if not wanted and not verify:
+                self.frames_skipped += 1
+                if end > n:
+                    self._skip = end - n
+                    self._pos = n
+                    self._needed = 8
+                    return None
+                pos = end
+                continue
+            if end > n:
+                self._pos = pos
+                self._needed = end - n
+                return None
+            (ck_a, ck_b) = ubx_checksum(buf, pos+2, end-2)
+            if ck_a == buf[end-2] and ck_b == buf[end-1]:
+                key = (msg_class, msg_id)
+                self.frame_counts[key] = self.frame_counts.get(key, 0) + 1
+                if not wanted:
+                    pos = end
+                    continue
+                self._pos = end
+                self._needed = 8
+                return memoryview(buf)[pos:end]
+            self.debug(1, "bad checksum len=%u" % (length + 8))
+            self.checksum_failures += 1
+            self.bytes_discarded += 1
+            pos += 1
+
+    def skip_pending(self):
+        '''return the number of stream bytes which will be discarded as the
+        rest of a skipped frame'''
+        return self._skip
+
+    def skipped(self, n):
+        '''note that n pending skip bytes were skipped by the caller, for
+        example by seeking a file'''
+        self._skip -= min(n, self._skip)
+
+    def __iter__(self):
+        '''iterate over the complete frames currently buffered'''
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+
+class UBloxLogIndex:
+    '''offset table of the frames in a UBX log file
+
+    The log is memory mapped and scanned once, recording the offset,
+    class, id and payload length of each valid frame, plus iTOW and week
+    for messages which carry them (-1 otherwise). The table is saved in a
+    sidecar file next to the log and reused while the log size and mtime
+    are unchanged. Columns are numpy arrays.
+    '''
+    sidecar_suffix = '.idx'
+    _magic = 'UBXIDX1\n'
+    _header = struct.Struct('<QdQ')
+    _columns = [('offsets', '<i8'), ('classes', 'u1'), ('ids', 'u1'),
+                ('lengths', '<u2'), ('itow', '<i4'), ('week', '<i2')]
+
+    def __init__(self, filename, use_sidecar=True, chunk_size=1<<24, processes=1):
+        import mmap
+        self.filename = filename
+        self._file = open(filename, mode='rb')
+        st = os.fstat(self._file.fileno())
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        if self.size > 0:
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = ''
+        self.sidecar = filename + self.sidecar_suffix
+        if use_sidecar and self._load_sidecar():
+            return
+        self._build(chunk_size, processes)
+        if use_sidecar:
+            self._save_sidecar()
+
+    def close(self):
+        '''close the log'''
+        if not isinstance(self.data, str):
+            self.data.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _build(self, chunk_size, processes):
+        '''scan the log, building the offset table'''
+        import numpy
+        d = numpy.frombuffer(self.data, numpy.uint8)
+        if processes > 1 and len(d) > chunk_size:
+            # find candidate frames in byte ranges in parallel, then chain
+            # them here so frames straddling a range boundary are handled
+            pool = multiprocessing.Pool(processes)
+            ranges = [(self.filename, lo, min(lo + chunk_size, len(d)))
+                      for lo in range(0, len(d), chunk_size)]
+            found = pool.map(_parallel_find_frames, ranges)
+            pool.close()
+            pool.join()
+            cand = numpy.concatenate([c for (c, l) in found])
+            lengths = numpy.concatenate([l for (c, l) in found])
+        else:
+            (cand, lengths) = ubx_find_frames(self.data, chunk_size=chunk_size)
+        self.offsets = ubx_chain_frames(cand, lengths)
+        o = self.offsets
+        self.classes = d[o+2].copy()
+        self.ids = d[o+3].copy()
+        self.lengths = (d[o+4].astype(numpy.uint16) | (d[o+5].astype(numpy.uint16) << 8))
+        self.itow = numpy.zeros(len(o), dtype=numpy.int32) - 1
+        self.week = numpy.zeros(len(o), dtype=numpy.int16) - 1
+        for (column, field) in [(self.itow, 'iTOW'), (self.week, 'week')]:
+            for (type, desc) in msg_types.items():
+                if not field in desc._field_offsets:
+                    continue
+                (s, fofs, alen) = desc._field_offsets[field]
+                sel = ((self.classes == type[0]) & (self.ids == type[1]) &
+                       (self.lengths >= fofs + s.size))
+                column[sel] = self._gather(d, o[sel] + 6 + fofs, s)
+
+    def _gather(self, d, offsets, s):
+        '''read a little endian integer field at each of offsets'''
+        import numpy
+        v = numpy.zeros(len(offsets), dtype=numpy.int64)
+        for i in range(s.size):
+            v |= d[offsets+i].astype(numpy.int64) << (8*i)
+        if s.format[-1] in 'bhil' and s.size < 8:
+            # sign extend
+            v[v >= (1 << (8*s.size-1))] -= (1 << (8*s.size))
+        return v
+
+    def _load_sidecar(self):
+        '''load the sidecar index, returning False if it is missing or stale'''
+        import numpy
+        try:
+            h = open(self.sidecar, mode='rb')
+            data = h.read()
+            h.close()
+        except IOError:
+            return False
+        hlen = len(self._magic) + self._header.size
+        if len(data) < hlen or not data.startswith(self._magic):
+            return False
+        (size, mtime, count) = self._header.unpack_from(data, len(self._magic))
+        if size != self.size or mtime != self.mtime:
+            return False
+        ofs = hlen
+        for (name, dtype) in self._columns:
+            nbytes = count * numpy.dtype(dtype).itemsize
+            if ofs + nbytes > len(data):
+                return False
+            setattr(self, name, numpy.frombuffer(data, dtype, count, ofs))
+            ofs += nbytes
+        return True
+
+    def _save_sidecar(self):
+        '''save the index next to the log, if we can'''
+        try:
+            h = open(self.sidecar + '.tmp', mode='wb')
+            h.write(self._magic)
+            h.write(self._header.pack(self.size, self.mtime, len(self.offsets)))
+            for (name, dtype) in self._columns:
+                h.write(getattr(self, name).astype(dtype).tostring())
+            h.close()
+            os.rename(self.sidecar + '.tmp', self.sidecar)
+        except (IOError, OSError) as e:
+            pass
+
+    def select(self, types=None, start=0):
+        '''return the entry numbers of frames of the given set of
+        (class, id) types at or after byte offset start, in file order.
+        None selects all types'''
+        import numpy
+        first = int(numpy.searchsorted(self.offsets, start))
+        if types is None:
+            return numpy.arange(first, len(self.offsets))
+        key = self.classes[first:].astype(numpy.int32) << 8 | self.ids[first:]
+        wanted = numpy.array([(c << 8) | i for (c, i) in types], dtype=numpy.int32)
+        return numpy.flatnonzero(numpy.in1d(key, wanted)) + first
+
+    def frame(self, i):
+        '''return the raw bytes of frame i'''
+        o = int(self.offsets[i])
+        return self.data[o:o+int(self.lengths[i])+8]
+
+    def message(self, i):
+        '''return frame i as a UBloxMessage'''
+        msg = UBloxMessage()
+        msg._buf = self.frame(i)
+        msg._checksum_ok = True
+        return msg
+
+    def table(self, msg_class, msg_id, start=0):
+        '''decode all frames of one message type at or after byte offset
+        start into a single numpy structured array. See
+        UBloxDescriptor.table()'''
+        desc = msg_types[(msg_class, msg_id)]
+        return desc.table([self.frame(i) for i in self.select([(msg_class, msg_id)], start)])
+
+    def cached_table(self, msg_class, msg_id, start=0):
+        '''as table(), but the table of the whole log is cached on disk
+        with util.cachedArrays() and reused while the log is unchanged. The
+        rows have an _offset column giving the file offset of their frame'''
+        import util
+        desc = msg_types[(msg_class, msg_id)]
+        def build():
+            sel = self.select([(msg_class, msg_id)])
+            return {'table' : desc.table([self.frame(i) for i in sel], self.offsets[sel])}
+        t = util.cachedArrays([self.filename], desc.name, build)['table']
+        if start > 0:
+            t = t[t['_offset'] >= start]
+        return t
+
+    def messages(self, types=None, start=0):
+        '''generate UBloxMessage objects for frames of the given set of
+        (class, id) types at or after byte offset start, in file order'''
+        for i in self.select(types, start):
+            yield self.message(i)
+
+    def find_time(self, week, tow):
+        '''return the byte offset of the first frame at or after GPS week
+        and time of week tow (in seconds), or the log size if there is
+        none. Frames without a week field take the week of the previous
+        frame which had one. If week is None only the time of week is
+        compared'''
+        import numpy
+        sel = numpy.flatnonzero(self.itow >= 0)
+        itow = self.itow[sel].astype(numpy.int64)
+        if week is None:
+            keys = itow
+        else:
+            # carry each week forward to the following frames
+            known = numpy.where(self.week >= 0, numpy.arange(len(self.week)), -1)
+            last = numpy.maximum.accumulate(known)[sel]
+            ok = last >= 0
+            sel = sel[ok]
+            keys = self.week[last[ok]].astype(numpy.int64) * 604800000 + itow[ok]
+        if len(keys) == 0:
+            return self.size
+        # time is non-decreasing apart from glitches, so search the running
+        # maximum
+        i = numpy.searchsorted(numpy.maximum.accumulate(keys),
+                               _time_key(week, int(round(tow * 1000))))
+        if i == len(sel):
+            return self.size
+        return int(self.offsets[sel[i]])
+
+    def parallel_tables(self, types, start=0, processes=None):
+        '''decode all frames of each of a list of (class, id) types at or
+        after byte offset start using a pool of worker processes,
+        returning a dictionary of numpy structured arrays keyed by type. See
+        UBloxDescriptor.table()'''
+        import numpy
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        jobs = []
+        for type in types:
+            sel = self.select([type], start)
+            for part in numpy.array_split(sel, processes):
+                jobs.append((self.filename, type, self.offsets[part], self.lengths[part]))
+        pool = multiprocessing.Pool(processes)
+        results = pool.map(_parallel_table, jobs)
+        pool.close()
+        pool.join()
+        ret = {}
+        for type in types:
+            ret[type] = numpy.concatenate([r for (j, r) in zip(jobs, results) if j[1] == type])
+        return ret
+
+    def parallel_messages(self, types=None, start=0, processes=None, batch_size=2000):
+        '''generate unpacked UBloxMessage objects for frames of the given
+        set of (class, id) types at or after byte offset start, in file
+        order, decoding batches of frames in a pool of worker processes'''
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        sel = self.select(types, start)
+        jobs = [(self.filename, self.offsets[sel[i:i+batch_size]], self.lengths[sel[i:i+batch_size]])
+                for i in range(0, len(sel), batch_size)]
+        pool = multiprocessing.Pool(processes)
+        try:
+            for msgs in pool.imap(_parallel_messages, jobs):
+                for msg in msgs:
+                    yield msg
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+class UBloxLogWriter:
+    '''buffered raw log file written by a background thread.
+
+    write() only queues the data, so the read loop never waits on the
+    disk unless the bounded queue is full. The thread batches queued data
+    and writes it out once flush_size bytes are pending or flush_interval
+    seconds have passed. With fsync=True each of those writes is followed
+    by an fsync(), so at most flush_interval seconds of data can be lost
+    in a crash; otherwise data reaches the OS within flush_interval but
+    is only fsynced on rotate() and close(). Open writers are closed at
+    exit.
+    '''
+    _flush = object()
+    _rotate = object()
+    _close = object()
+
+    def __init__(self, filename, append=False, flush_interval=1.0, flush_size=65536,
+                 queue_size=1024, fsync=False):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.fsync = fsync
+        self.error = None
+        self._file = self._open(filename, append)
+        # set when data has been written since the last fsync
+        self._dirty = False
+        self._queue = Queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._run, name='UBloxLogWriter')
+        self._thread.daemon = True
+        self._thread.start()
+        _log_writers.add(self)
+
+    def _open(self, filename, append):
+        if append:
+            return open(filename, mode='ab')
+        return open(filename, mode='wb')
+
+    def _check(self):
+        '''re-raise any error from the writer thread'''
+        if self.error is not None:
+            raise self.error
+
+    def write(self, buf):
+        '''queue some bytes for writing'''
+        self._check()
+        self._queue.put(buf)
+
+    def flush(self):
+        '''wait until all queued data has been written to the OS'''
+        self._check()
+        self._queue.put(self._flush)
+        self._queue.join()
+        self._check()
+
+    def rotate(self, filename, append=False):
+        '''fsync and close the current file, then continue in a new one'''
+        self._check()
+        self._queue.put((self._rotate, filename, append))
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        '''write out all queued data, fsync and close the file'''
+        if self._file is None:
+            return
+        self._queue.put(self._close)
+        self._thread.join()
+        _log_writers.discard(self)
+        self._check()
+
+    def _write(self, pending, sync):
+        '''write a batch of data from the thread. The file is only
+        fsynced if something was written to it since the last fsync'''
+        if pending:
+            self._file.write(''.join(pending))
+            self._file.flush()
+            self._dirty = True
+        if sync and self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def _run(self):
+        '''writer thread main loop'''
+        pending = []
+        size = 0
+        deadline = time.time() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(True, max(0, deadline - time.time()))
+            except Queue.Empty:
+                # flush interval expired
+                item = None
+            if isinstance(item, str):
+                pending.append(item)
+                size += len(item)
+                self._queue.task_done()
+                if size < self.flush_size and time.time() < deadline:
+                    continue
+                item = None
+            try:
+                if item is None or item is self._flush:
+                    self._write(pending, self.fsync)
+                elif item is self._close:
+                    self._write(pending, True)
+                    self._file.close()
+                    self._file = None
+                else:
+                    (marker, filename, append) = item
+                    self._write(pending, True)
+                    self._file.close()
+                    self._file = self._open(filename, append)
+                    self.filename = filename
+            except (IOError, OSError) as e:
+                self.error = e
+            if item is not None and not isinstance(item, str):
+                self._queue.task_done()
+            if item is self._close:
+                return
+            pending = []
+            size = 0
+            deadline = time.time() + self.flush_interval
+
+_log_writers = set()
+
+def _close_log_writers():
+    '''close any log writers still open at exit'''
+    for w in list(_log_writers):
+        w.close()
+
+atexit.register(_close_log_writers)
+
+
 class UBlox:
     '''main UBlox control class.
 
@@ -698,48 +1955,96 @@ class UBlox:
                                      dsrdtr=False, rtscts=False, xonxoff=False, timeout=timeout)
         self.logfile = None
         self.log = None
+        self.framer = UBloxFramer()
+        self.send_queue = ''
+        self.read_ahead = 65536
+        self.reset_stats()
+        self.eof = False
         self.preferred_dynamic_model = None
         self.preferred_usePPP = None
         self.preferred_dgps_timeout = None
+        # the corrections special_handling() is making by message type,
+        # how often each has been tried, and the types it has given up on
+        self.config_corrections = {}
+        self.config_attempts = {}
+        self.max_corrections = 3
+        self.refused_config = set()
+        # the session between begin_config() and end_config(), and the
+        # sessions started by end_config() which are still running
+        self.config_session = None
+        self.config_sessions = []
 
     def close(self):
 	'''close the device'''
         self.dev.close()
 	self.dev = None
+        self.config_sessions = []
+        if self.log is not None:
+            self.log.close()
+            self.log = None
 
     def set_debug(self, debug_level):
         '''set debug level'''
         self.debug_level = debug_level
+        self.framer.debug_level = debug_level
 
     def debug(self, level, msg):
         '''write a debug message'''
         if self.debug_level >= level:
             print(msg)
 
-    def set_logfile(self, logfile, append=False):
-	'''setup logging to a file'''
+    def reset_stats(self):
+        '''zero the parser counters, including the shared unpack counters
+        of UBloxMessage'''
+        self.bytes_read = 0
+        self.unknown_messages = 0
+        self.read_time = 0.0
+        self.frame_time = 0.0
+        self.framer.reset_stats()
+        UBloxMessage.unpack_count = 0
+        UBloxMessage.unpack_time = 0.0
+
+    def stats(self):
+        '''return a snapshot of the parser counters as a dictionary'''
+        return {
+            'bytes_read' : self.bytes_read,
+            'frames' : dict(self.framer.frame_counts),
+            'frames_skipped' : self.framer.frames_skipped,
+            'checksum_failures' : self.framer.checksum_failures,
+            'bytes_discarded' : self.framer.bytes_discarded,
+            'unknown_messages' : self.unknown_messages,
+            'read_time' : self.read_time,
+            'frame_time' : self.frame_time,
+            'unpack_count' : UBloxMessage.unpack_count,
+            'unpack_time' : UBloxMessage.unpack_time,
+            }
+
+    def set_logfile(self, logfile, append=False, flush_interval=1.0, fsync=False):
+	'''setup logging to a file. See UBloxLogWriter for flush_interval
+        and fsync'''
         if self.log is not None:
             self.log.close()
             self.log = None
         self.logfile = logfile
         if self.logfile is not None:
-            if append:
-                mode = 'ab'
-            else:
-                mode = 'wb'
-            self.log = open(self.logfile, mode=mode)
+            self.log = UBloxLogWriter(self.logfile, append=append,
+                                      flush_interval=flush_interval, fsync=fsync)
 
     def set_preferred_dynamic_model(self, model):
         '''set the preferred dynamic model for receiver'''
         self.preferred_dynamic_model = model
+        self.refused_config.discard((CLASS_CFG, MSG_CFG_NAV5))
+        self.config_attempts.pop((CLASS_CFG, MSG_CFG_NAV5), None)
         if model is not None:
-            self.configure_poll(CLASS_CFG, MSG_CFG_NAV5)
+            self.poll_preferred(MSG_CFG_NAV5)
 
     def set_preferred_dgps_timeout(self, timeout):
         '''set the preferred DGPS timeout for receiver'''
         self.preferred_dgps_timeout = timeout
+        self.refused_config.discard((CLASS_CFG, MSG_CFG_NAV5))
+        self.config_attempts.pop((CLASS_CFG, MSG_CFG_NAV5), None)
         if timeout is not None:
-            self.configure_poll(CLASS_CFG, MSG_CFG_NAV5)
+            self.poll_preferred(MSG_CFG_NAV5)
 
     def set_preferred_usePPP(self, usePPP):
         '''set the preferred usePPP setting for the receiver'''
@@ -747,7 +2052,22 @@ class UBlox:
             self.preferred_usePPP = None
             return
         self.preferred_usePPP = int(usePPP)
-        self.configure_poll(CLASS_CFG, MSG_CFG_NAVX5)
+        self.refused_config.discard((CLASS_CFG, MSG_CFG_NAVX5))
+        self.config_attempts.pop((CLASS_CFG, MSG_CFG_NAVX5), None)
+        self.poll_preferred(MSG_CFG_NAVX5)
+
+    def poll_preferred(self, msg_id):
+        '''poll a CFG message special_handling() checks against the
+        preferred settings. Outside begin_config() the poll gets a session
+        of its own, so the ACK that follows the reply completes it rather
+        than being taken for the reply to a correction'''
+        if self.config_session is not None:
+            self.configure_poll(CLASS_CFG, msg_id)
+            return
+        session = UBloxConfigSession(self)
+        session.add(CLASS_CFG, msg_id)
+        self.config_sessions.append(session)
+        self.poll_config()
 
     def nmea_checksum(self, msg):
         d = msg[1:]
@@ -763,6 +2083,30 @@ class UBlox:
                 return self.dev.send(buf)
             return self.dev.write(buf)
 
+    def fileno(self):
+        '''return the file descriptor of the device, for use with select()'''
+        return self.dev.fileno()
+
+    def read_available(self, n=65536):
+        '''read up to n bytes which are available without blocking'''
+        if self.use_sendrecv:
+            import socket
+            try:
+                b = self.dev.recv(n, socket.MSG_DONTWAIT)
+            except socket.error as e:
+                return ''
+            # recv() only returns no data once the peer has closed
+            self.eof = not b
+            return b
+        if self.read_only:
+            b = self.dev.read(n)
+            self.eof = not b
+            return b
+        waiting = self.dev.inWaiting()
+        if waiting == 0:
+            return ''
+        return self.dev.read(min(n, waiting))
+
     def read(self, n):
         '''read some bytes'''
         if self.use_sendrecv:
@@ -788,60 +2132,214 @@ class UBlox:
 	self.dev.seek(0, 2)
 	filesize = self.dev.tell()
 	self.dev.seek(pct*0.01*filesize)
+        self.framer.reset()
+
+    def seek_time(self, week, tow):
+	'''seek a log file to the first message at or after GPS week and
+        time of week tow (in seconds). If week is None only the time of
+        week is compared. The sidecar index is used if the log has one,
+        otherwise the file is bisected'''
+        import mmap
+        if os.path.exists(self.serial_device + UBloxLogIndex.sidecar_suffix):
+            index = UBloxLogIndex(self.serial_device)
+            ofs = index.find_time(week, tow)
+            index.close()
+        else:
+            data = mmap.mmap(self.dev.fileno(), 0, access=mmap.ACCESS_READ)
+            ofs = ubx_find_time(data, week, tow)
+            data.close()
+        self.dev.seek(ofs)
+        self.framer.reset()
 
     def special_handling(self, msg):
-        '''handle automatic configuration changes'''
+        '''handle automatic configuration changes.
+
+        A correction is sent in a configuration session which then
+        re-polls the message, and the reply is checked in turn, so a
+        setting which did not take effect is corrected again. A receiver
+        which refuses the correction with an ACK_NACK, or still reports
+        the wrong setting after max_corrections attempts, is left alone
+        until the preference is set again'''
+        if not msg.name() in ['CFG_NAV5', 'CFG_NAVX5'] or self.read_only:
+            return
+        key = msg.msg_type()
+        if key in self.refused_config or key in self.config_corrections:
+            return
+        payload = None
         if msg.name() == 'CFG_NAV5':
             msg.unpack()
             sendit = False
-            pollit = False
             if self.preferred_dynamic_model is not None and msg.dynModel != self.preferred_dynamic_model:
                 msg.dynModel = self.preferred_dynamic_model
                 sendit = True
-                pollit = True
             if self.preferred_dgps_timeout is not None and msg.dgpsTimeOut != self.preferred_dgps_timeout:
                 msg.dgpsTimeOut = self.preferred_dgps_timeout
                 self.debug(2, "Setting dgpsTimeOut=%u" % msg.dgpsTimeOut)
                 sendit = True
-                # we don't re-poll for this one, as some receivers refuse to set it
             if sendit:
                 msg.pack()
-                self.send(msg)
-                if pollit:
-                    self.configure_poll(CLASS_CFG, MSG_CFG_NAV5)
-        if msg.name() == 'CFG_NAVX5' and self.preferred_usePPP is not None:
+                payload = msg._buf[6:-2]
+        elif msg.name() == 'CFG_NAVX5' and self.preferred_usePPP is not None:
             msg.unpack()
             if msg.usePPP != self.preferred_usePPP:
                 msg.usePPP = self.preferred_usePPP
                 msg.mask = 1<<13
                 msg.pack()
-                self.send(msg)
-                self.configure_poll(CLASS_CFG, MSG_CFG_NAVX5)
-
-
-    def receive_message(self, ignore_eof=False):
-	'''blocking receive of one ublox message'''
-        msg = UBloxMessage()
+                payload = msg._buf[6:-2]
+        else:
+            return
+        if payload is None:
+            # the receiver has the preferred setting
+            self.config_attempts.pop(key, None)
+            return
+        attempts = self.config_attempts.get(key, 0)
+        if attempts >= self.max_corrections:
+            self.debug(1, "Receiver ignored %s" % msg.name())
+            self.refused_config.add(key)
+            return
+        self.config_attempts[key] = attempts + 1
+        session = UBloxConfigSession(self, window=1)
+        session.add(key[0], key[1], payload)
+        session.add(key[0], key[1])
+        session.done = self._correction_done
+        self.config_corrections[key] = session
+        self.config_sessions.append(session)
+        self.poll_config()
+
+    def _correction_done(self, session):
+        '''check the result of a correction sent by special_handling()'''
+        (write, poll) = session.commands
+        key = write.key()
+        del self.config_corrections[key]
+        if write.status == UBloxCommand.NACK:
+            self.debug(1, "Receiver refused %s" % write.name())
+            self.refused_config.add(key)
+        elif poll.response is not None:
+            self.special_handling(poll.response)
+
+    def special_types(self):
+        '''return the set of message types special_handling() needs to see'''
+        ret = set()
+        if self.preferred_dynamic_model is not None or self.preferred_dgps_timeout is not None:
+            ret.add((CLASS_CFG, MSG_CFG_NAV5))
+        if self.preferred_usePPP is not None:
+            ret.add((CLASS_CFG, MSG_CFG_NAVX5))
+        if self.config_sessions:
+            ret |= self.config_sessions[0].reply_types()
+        return ret
+
+    def receive_message(self, ignore_eof=False, types=None, verify=True):
+	'''blocking receive of one ublox message.
+
+        If types is a set of (class, id) tuples, only messages of those
+        types are returned, and other frames are dropped without creating
+        message objects. With verify=False unwanted frames are skipped
+        using their length field, without being checksummed; in a file
+        they are seeked over rather than read. This is faster, but a
+        corrupt length field can then cause valid frames to be missed.
+        '''
+        if self.config_sessions:
+            self.poll_config()
+        wanted = types
+        if types is not None:
+            wanted = set(types) | self.special_types()
         while True:
-            n = msg.needed_bytes()
+            t0 = time.time()
+            frame = self.framer.next_frame(wanted, verify)
+            self.frame_time += time.time() - t0
+            if frame is not None:
+                msg = self._frame_message(frame)
+                if types is not None and not msg.msg_type() in types:
+                    continue
+                return msg
+            skip = self.framer.skip_pending()
+            if skip > 0 and self.read_only and self.log is None:
+                self.dev.seek(skip, 1)
+                self.framer.skipped(skip)
+                continue
+            n = self._read_size(self.framer.needed_bytes())
+            t0 = time.time()
             b = self.read(n)
+            self.read_time += time.time() - t0
             if not b:
                 if ignore_eof:
                     time.sleep(0.01)
                     continue
                 return None
-            msg.add(b)
-            if self.log is not None:
-                self.log.write(b)
-                self.log.flush()
-            if msg.valid():
-                self.special_handling(msg)
-                return msg
+            self._add_input(b)
+
+    def _read_size(self, n):
+        '''return how many bytes to read when at least n more are needed.
+        Files and sockets read ahead by up to read_ahead bytes, serial
+        devices read whatever has already arrived'''
+        if self.read_only or self.use_sendrecv:
+            return max(n, self.read_ahead)
+        return max(n, self.dev.inWaiting())
+
+    def _frame_message(self, frame):
+        '''make a UBloxMessage from a frame returned by the framer'''
+        msg = UBloxMessage()
+        msg._buf = frame.tobytes()
+        # the framer has already verified the checksum
+        msg._checksum_ok = True
+        if not msg.msg_type() in msg_types:
+            self.unknown_messages += 1
+        if self.config_sessions:
+            self.config_sessions[0].handle(msg)
+            self.poll_config()
+        self.special_handling(msg)
+        return msg
+
+    def _add_input(self, b):
+        '''pass bytes read from the device to the framer and the log'''
+        self.bytes_read += len(b)
+        self.framer.add(b)
+        if self.log is not None:
+            self.log.write(b)
+
+    def receive_available(self, types=None):
+        '''non-blocking receive of all the ublox messages which can be
+        completed from the bytes already available on the device. Returns
+        a list, which is empty if no complete message is available. See
+        receive_message() for types'''
+        if self.config_sessions:
+            self.poll_config()
+        t0 = time.time()
+        b = self.read_available()
+        self.read_time += time.time() - t0
+        if b:
+            self._add_input(b)
+        wanted = types
+        if types is not None:
+            wanted = set(types) | self.special_types()
+        ret = []
+        while True:
+            t0 = time.time()
+            frame = self.framer.next_frame(wanted)
+            self.frame_time += time.time() - t0
+            if frame is None:
+                return ret
+            try:
+                msg = self._frame_message(frame)
+            except UBloxError as e:
+                # don't lose the rest of the batch to an unknown message
+                self.debug(1, e.message)
+                continue
+            if types is None or msg.msg_type() in types:
+                ret.append(msg)
+
+    def messages(self, ignore_eof=False, types=None):
+        '''generate ublox messages until end of file. See receive_message()'''
+        while True:
+            msg = self.receive_message(ignore_eof=ignore_eof, types=types)
+            if msg is None:
+                return
+            yield msg
 
-    def receive_message_noerror(self, ignore_eof=False):
+    def receive_message_noerror(self, ignore_eof=False, types=None, verify=True):
 	'''blocking receive of one ublox message, ignoring errors'''
         try:
-            return self.receive_message(ignore_eof=ignore_eof)
+            return self.receive_message(ignore_eof=ignore_eof, types=types, verify=verify)
         except UBloxError as e:
             print(e)
             return None
@@ -851,63 +2349,446 @@ class UBlox:
             print(e)
             return None
 
-    def send(self, msg):
-	'''send a preformatted ublox message'''
+    def send(self, msg, block=True):
+	'''send a preformatted ublox message. With block=False the message is
+        queued and as much as the device accepts without blocking is
+        written now, see flush_send()'''
         if not msg.valid():
             self.debug(1, "invalid send")
             return
-        if not self.read_only:
-            self.write(msg._buf)        
-
-    def send_message(self, msg_class, msg_id, payload):
-	'''send a ublox message with class, id and payload'''
+        if self.read_only:
+            return
+        if block and not self.send_queue:
+            self.write(msg._buf)
+        else:
+            self.send_queue += msg._buf
+            self.flush_send()
+
+    def flush_send(self):
+        '''write as much of the send queue as the device accepts without
+        blocking, returning the number of bytes still queued'''
+        import select, errno
+        while self.send_queue:
+            (r, w, x) = select.select([], [self.fileno()], [], 0)
+            if not w:
+                break
+            try:
+                if self.use_sendrecv:
+                    import socket
+                    n = self.dev.send(self.send_queue, socket.MSG_DONTWAIT)
+                else:
+                    n = os.write(self.fileno(), self.send_queue)
+            except (OSError, IOError) as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    break
+                raise
+            self.send_queue = self.send_queue[n:]
+        return len(self.send_queue)
+
+    def send_message(self, msg_class, msg_id, payload, block=True):
+	'''send a ublox message with class, id and payload. Between
+        begin_config() and end_config() the message is added to the
+        configuration session instead, and its UBloxCommand returned'''
+        if self.config_session is not None:
+            return self.config_session.add(msg_class, msg_id, payload)
         msg = UBloxMessage()
-        msg._buf = struct.pack('<BBBBH', 0xb5, 0x62, msg_class, msg_id, len(payload))
-        msg._buf += payload
-        (ck_a, ck_b) = msg.checksum(msg._buf[2:])
-        msg._buf += struct.pack('<BB', ck_a, ck_b)
-        self.send(msg)
+        buf = struct.pack('<BBBBH', 0xb5, 0x62, msg_class, msg_id, len(payload)) + payload
+        msg._buf = buf + struct.pack('<BB', *ubx_checksum(buf, 2))
+        self.send(msg, block=block)
+
+    def begin_config(self, window=4, timeout=1.0, retries=2):
+        '''start a configuration session. The configure_*() and
+        send_message() calls which follow are queued, and sent and
+        checked once end_config() is called. See UBloxConfigSession'''
+        if self.config_session is not None:
+            raise UBloxError('begin_config() with a configuration session already open')
+        self.config_session = UBloxConfigSession(self, window=window, timeout=timeout, retries=retries)
+        return self.config_session
+
+    def end_config(self, done=None):
+        '''start the configuration session opened by begin_config(),
+        returning it. This does not wait for the replies: the session
+        runs as messages are received, so it needs the device to be read
+        as usual, by receive_message(), receive_available() or a
+        UBloxMultiplexer. Messages are still returned to the caller as
+        normal. done(session) is called once every command has completed.
+        Sessions started while another is running wait for it to finish'''
+        session = self.config_session
+        if session is None:
+            raise UBloxError('end_config() without begin_config()')
+        self.config_session = None
+        session.done = done
+        self.config_sessions.append(session)
+        self.poll_config()
+        return session
+
+    def poll_config(self):
+        '''advance the running configuration sessions, sending commands
+        as the window allows and resending or timing out those without a
+        reply. This is called on each receive, and should also be called
+        by event loops when config_deadline() passes'''
+        while self.config_sessions:
+            session = self.config_sessions[0]
+            if not session.step():
+                return
+            # a done callback may have started a session, and polled
+            # this one off the list already
+            if session in self.config_sessions:
+                self.config_sessions.remove(session)
+
+    def config_deadline(self):
+        '''return the time poll_config() next needs to be called by, or
+        None if no configuration session is waiting on a reply'''
+        if not self.config_sessions:
+            return None
+        return self.config_sessions[0].deadline()
 
     def configure_solution_rate(self, rate_ms=200, nav_rate=1, timeref=0):
 	'''configure the solution rate in milliseconds'''
         payload = struct.pack('<HHH', rate_ms, nav_rate, timeref)
-        self.send_message(CLASS_CFG, MSG_CFG_RATE, payload)
+        return self.send_message(CLASS_CFG, MSG_CFG_RATE, payload)
 
     def configure_message_rate(self, msg_class, msg_id, rate):
 	'''configure the message rate for a given message'''
         payload = struct.pack('<BBB', msg_class, msg_id, rate)
-        self.send_message(CLASS_CFG, MSG_CFG_MSG, payload)
+        return self.send_message(CLASS_CFG, MSG_CFG_MSG, payload)
 
     def configure_port(self, port=1, inMask=3, outMask=3, mode=2240, baudrate=None):
 	'''configure a IO port'''
         if baudrate is None:
             baudrate = self.baudrate
         payload = struct.pack('<BBHIIHHHH', port, 0xff, 0, mode, baudrate, inMask, outMask, 0xFFFF, 0xFFFF)
-        self.send_message(CLASS_CFG, MSG_CFG_PRT, payload)
+        return self.send_message(CLASS_CFG, MSG_CFG_PRT, payload)
 
     def configure_loadsave(self, clearMask=0, saveMask=0, loadMask=0, deviceMask=0):
 	'''configure configuration load/save'''
         payload = struct.pack('<IIIB', clearMask, saveMask, loadMask, deviceMask)
-        self.send_message(CLASS_CFG, MSG_CFG_CFG, payload)
+        return self.send_message(CLASS_CFG, MSG_CFG_CFG, payload)
 
     def configure_poll(self, msg_class, msg_id, payload=''):
 	'''poll a configuration message'''
-        self.send_message(msg_class, msg_id, payload)
+        return self.send_message(msg_class, msg_id, payload)
 
     def configure_poll_port(self, portID=None):
 	'''poll a port configuration'''
         if portID is None:
-            self.configure_poll(CLASS_CFG, MSG_CFG_PRT)
+            return self.configure_poll(CLASS_CFG, MSG_CFG_PRT)
         else:
-            self.configure_poll(CLASS_CFG, MSG_CFG_PRT, struct.pack('<B', portID))
+            return self.configure_poll(CLASS_CFG, MSG_CFG_PRT, struct.pack('<B', portID))
 
     def configure_min_max_sats(self, min_sats=4, max_sats=32):
         '''Set the minimum/maximum number of satellites for a solution in the NAVX5 message'''
         payload = struct.pack('<HHIBBBBBBBBBBHIBBBBBBHII', 0, 4, 0, 0, 0, min_sats, max_sats, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-        self.send_message(CLASS_CFG, MSG_CFG_NAVX5, payload)
+        return self.send_message(CLASS_CFG, MSG_CFG_NAVX5, payload)
 
     def module_reset(self, set, mode):
         ''' Reset the module for hot/warm/cold start'''
         payload = struct.pack('<HBB', set, mode, 0)
-        self.send_message(CLASS_CFG, MSG_CFG_RST, payload)
+        return self.send_message(CLASS_CFG, MSG_CFG_RST, payload)
 
+
+class UBloxCommand:
+    '''a message sent by a UBloxConfigSession, and its result.
+
+    expect is EXPECT_ACK for messages answered by ACK_ACK/ACK_NACK,
+    EXPECT_RESPONSE for polls answered by a message of the same type,
+    or EXPECT_NONE. status is None until the command completes
+    '''
+    EXPECT_NONE = 0
+    EXPECT_ACK = 1
+    EXPECT_RESPONSE = 2
+
+    ACK = 'ACK'
+    NACK = 'NACK'
+    RESPONSE = 'RESPONSE'
+    SENT = 'SENT'
+    TIMEOUT = 'TIMEOUT'
+    SKIPPED = 'SKIPPED'
+
+    def __init__(self, msg_class, msg_id, payload, expect):
+        self.msg_class = msg_class
+        self.msg_id = msg_id
+        self.payload = payload
+        self.expect = expect
+        self.msg = UBloxMessage()
+        buf = struct.pack('<BBBBH', PREAMBLE1, PREAMBLE2, msg_class, msg_id, len(payload)) + payload
+        self.msg._buf = buf + struct.pack('<BB', *ubx_checksum(buf, 2))
+        self.status = None
+        self.response = None
+        self.attempts = 0
+        self.deadline = None
+        self.elapsed = None
+        self.sent_time = None
+
+    def key(self):
+        '''the (class, id) the reply is matched on'''
+        return (self.msg_class, self.msg_id)
+
+    def name(self):
+        '''return the message name'''
+        if self.key() in msg_types:
+            return msg_types[self.key()].name
+        return 'UBX(0x%02x,0x%02x)' % self.key()
+
+    def ok(self):
+        '''return True if the command completed successfully'''
+        return self.status in [self.ACK, self.RESPONSE, self.SENT]
+
+    def __str__(self):
+        ret = '%s %s attempts=%u' % (self.name(), self.status, self.attempts)
+        if self.elapsed is not None:
+            ret += ' time=%.3f' % self.elapsed
+        return ret
+
+
+class UBloxConfigSession:
+    '''send a batch of configuration messages to a receiver, keeping up
+    to window of them in flight at once, and check each is acknowledged.
+
+    A session does not wait for replies itself. Once started by
+    UBlox.end_config() it is advanced by the device's receives, which
+    pass it every message, and by UBlox.poll_config() for timeouts, so
+    other receivers in the same event loop keep being served.
+
+    Replies carry only the class and id of the message they answer, so
+    at most one command of each (class, id) is in flight at a time, and
+    commands of the same type complete in the order they were added.
+    Commands of different types may complete out of order, use window=1
+    if that matters. A command without a reply within timeout seconds
+    is resent up to retries times.
+    '''
+    def __init__(self, dev, window=4, timeout=1.0, retries=2):
+        self.dev = dev
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.commands = []
+        self.pending = []
+        self.inflight = {}
+        self.done = None
+        self.complete = False
+
+    def add(self, msg_class, msg_id, payload='', expect=None):
+        '''queue a message, returning its UBloxCommand. By default CFG
+        messages expect an ACK, except CFG_RST which has no reply, and
+        other messages are treated as polls expecting a response'''
+        if expect is None:
+            if msg_class == CLASS_CFG and msg_id == MSG_CFG_RST:
+                expect = UBloxCommand.EXPECT_NONE
+            elif msg_class == CLASS_CFG:
+                expect = UBloxCommand.EXPECT_ACK
+            else:
+                expect = UBloxCommand.EXPECT_RESPONSE
+        cmd = UBloxCommand(msg_class, msg_id, payload, expect)
+        self.commands.append(cmd)
+        self.pending.append(cmd)
+        return cmd
+
+    def failures(self):
+        '''return the completed commands which did not succeed'''
+        return [cmd for cmd in self.commands if cmd.status is not None and not cmd.ok()]
+
+    def reply_types(self):
+        '''return the set of message types the session is waiting for'''
+        ret = set(self.inflight.keys())
+        if ret:
+            ret.add((CLASS_ACK, MSG_ACK_ACK))
+            ret.add((CLASS_ACK, MSG_ACK_NACK))
+        return ret
+
+    def deadline(self):
+        '''return the time the next command in flight times out, or None'''
+        if not self.inflight:
+            return None
+        return min([cmd.deadline for cmd in self.inflight.values()])
+
+    def _send(self, cmd):
+        '''send or resend a command'''
+        now = time.time()
+        if cmd.attempts == 0:
+            cmd.sent_time = now
+        cmd.attempts += 1
+        cmd.deadline = now + self.timeout
+        self.dev.send(cmd.msg)
+        if cmd.expect == UBloxCommand.EXPECT_NONE:
+            self._finish(cmd, UBloxCommand.SENT)
+        else:
+            self.inflight[cmd.key()] = cmd
+
+    def _finish(self, cmd, status):
+        '''record the result of a command'''
+        cmd.status = status
+        cmd.elapsed = time.time() - cmd.sent_time
+        if self.inflight.get(cmd.key(), None) is cmd:
+            del self.inflight[cmd.key()]
+        self.dev.debug(2, "Config %s" % cmd)
+
+    def _fill(self):
+        '''send pending commands while the window has room'''
+        for cmd in self.pending[:]:
+            if len(self.inflight) >= self.window:
+                return
+            if cmd.key() in self.inflight:
+                continue
+            self.pending.remove(cmd)
+            self._send(cmd)
+
+    def _check_timeouts(self):
+        '''resend or give up on commands past their deadline'''
+        now = time.time()
+        for cmd in self.inflight.values():
+            if now < cmd.deadline:
+                continue
+            if cmd.attempts > self.retries:
+                self._finish(cmd, UBloxCommand.TIMEOUT)
+            else:
+                self.dev.debug(2, "Resending %s" % cmd.name())
+                self._send(cmd)
+
+    def handle(self, msg):
+        '''match a received message against the commands in flight'''
+        msg_type = msg.msg_type()
+        if msg_type in [(CLASS_ACK, MSG_ACK_ACK), (CLASS_ACK, MSG_ACK_NACK)]:
+            msg.unpack()
+            cmd = self.inflight.get((msg.clsID, msg.msgID), None)
+            if cmd is None or cmd.expect != UBloxCommand.EXPECT_ACK:
+                return
+            if msg_type[1] == MSG_ACK_ACK:
+                self._finish(cmd, UBloxCommand.ACK)
+            else:
+                self._finish(cmd, UBloxCommand.NACK)
+            return
+        cmd = self.inflight.get(msg_type, None)
+        if cmd is None:
+            return
+        # CFG polls are answered with the message and then an ACK
+        cmd.response = msg
+        if cmd.expect == UBloxCommand.EXPECT_RESPONSE:
+            self._finish(cmd, UBloxCommand.RESPONSE)
+
+    def step(self):
+        '''send commands as the window allows and handle timeouts,
+        without waiting. Returns True once every command has completed,
+        calling done(session) the first time'''
+        if self.complete:
+            return True
+        if self.dev.read_only:
+            for cmd in self.pending:
+                cmd.status = UBloxCommand.SKIPPED
+            self.pending = []
+        else:
+            self._check_timeouts()
+            self._fill()
+        if self.pending or self.inflight:
+            return False
+        self.complete = True
+        if self.done is not None:
+            self.done(self)
+        return True
+
+
+def show_config_failures(session):
+    '''print the configuration commands a receiver did not accept. For
+    use as the done callback of UBlox.end_config()'''
+    for cmd in session.failures():
+        print("%s: %s" % (session.dev.serial_device, cmd))
+
+
+class UBloxMultiplexer:
+    '''select() based event loop over several UBlox devices and other
+    readable files.
+
+    Each source has its own callback, which is only called when the
+    source has data, so a slow device does not delay the others and an
+    idle loop sleeps in select(). Configuration sessions running on the
+    devices are polled here, so they never block the loop. Devices are removed when they reach
+    end of file, and run() returns once no sources remain.
+    '''
+    def __init__(self):
+        self.devices = {}
+        self.sources = {}
+        self.timers = []
+
+    def add_device(self, dev, callback, types=None):
+        '''call callback(msg) for each message received from a UBlox
+        device. See UBlox.receive_message() for types'''
+        self.devices[dev.fileno()] = (dev, callback, types)
+
+    def remove_device(self, dev):
+        '''stop watching a UBlox device'''
+        for (fd, (d, callback, types)) in self.devices.items():
+            if d is dev:
+                del self.devices[fd]
+
+    def add_source(self, f, callback, size=4096):
+        '''call callback(data) with the bytes read from a file, pipe or
+        socket whenever it is readable'''
+        self.sources[f.fileno()] = (f, callback, size)
+
+    def remove_source(self, f):
+        '''stop watching a file'''
+        for (fd, (s, callback, size)) in self.sources.items():
+            if s is f:
+                del self.sources[fd]
+
+    def add_timer(self, interval, callback):
+        '''call callback() every interval seconds'''
+        self.timers.append([interval, time.time() + interval, callback])
+
+    def _timeout(self, timeout):
+        '''return the select timeout, allowing for the next timer and
+        configuration session deadline'''
+        deadlines = [t[1] for t in self.timers]
+        for (dev, callback, types) in self.devices.values():
+            d = dev.config_deadline()
+            if d is not None:
+                deadlines.append(d)
+        if not deadlines:
+            return timeout
+        t = max(0, min(deadlines) - time.time())
+        if timeout is None:
+            return t
+        return min(t, timeout)
+
+    def run_once(self, timeout=None):
+        '''wait for at most timeout seconds for any source to be readable,
+        then dispatch its data and any due timers'''
+        import select
+        rlist = self.devices.keys() + self.sources.keys()
+        wlist = [fd for (fd, (dev, callback, types)) in self.devices.items() if dev.send_queue]
+        (r, w, x) = select.select(rlist, wlist, [], self._timeout(timeout))
+        for fd in w:
+            if fd in self.devices:
+                self.devices[fd][0].flush_send()
+        for fd in r:
+            if fd in self.devices:
+                (dev, callback, types) = self.devices[fd]
+                try:
+                    msgs = dev.receive_available(types)
+                except (UBloxError, OSError, IOError) as e:
+                    print(e)
+                    continue
+                if dev.eof:
+                    del self.devices[fd]
+                for msg in msgs:
+                    callback(msg)
+            elif fd in self.sources:
+                (f, callback, size) = self.sources[fd]
+                data = os.read(fd, size)
+                if not data:
+                    del self.sources[fd]
+                    continue
+                callback(data)
+        for (dev, callback, types) in self.devices.values():
+            if dev.config_sessions:
+                dev.poll_config()
+        now = time.time()
+        for t in self.timers:
+            if now >= t[1]:
+                t[1] = now + t[0]
+                t[2]()
+
+    def run(self):
+        '''run the event loop until there are no sources left'''
+        while self.devices or self.sources:
+            self.run_once()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+'''
+benchmark UBX framing, parsing, packing and printing on a synthetic stream
+'''
+
+import ublox, sys, os, time, random, struct, gc, resource, tempfile, atexit
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from optparse import OptionParser
+
+parser = OptionParser("ublox_bench.py [options]")
+parser.add_option("--seconds", type='int', default=600, help="length of the synthetic stream in seconds")
+parser.add_option("--rate", type='int', default=5, help="navigation rate in Hz")
+parser.add_option("--sats", type='int', default=12, help="number of satellites tracked")
+parser.add_option("--all-types", action='store_true', default=False, help="add one frame of every known message type each second")
+parser.add_option("--corrupt", type='float', default=0, help="probability of a corrupted byte in each frame")
+parser.add_option("--truncate", type='float', default=0, help="probability of truncating each frame")
+parser.add_option("--garbage", type='float', default=0, help="probability of random bytes before each frame")
+parser.add_option("--seed", type='int', default=1, help="random seed")
+parser.add_option("--save", default=None, help="save the synthetic stream to a file")
+parser.add_option("--tests", default='add,framer,receive,unpack,unpack_lazy,pack,format', help="comma separated list of benchmarks to run")
+
+(opts, args) = parser.parse_args()
+
+rand = random.Random(opts.seed)
+
+def random_value(code):
+    '''return a random value for a struct format code'''
+    if code.endswith('s'):
+        return ''.join([chr(rand.randint(32, 126)) for i in range(int(code[:-1] or 1))])
+    if code in 'fd':
+        return rand.uniform(-1.0e6, 1.0e6)
+    if code == 'c':
+        return chr(rand.randint(0, 255))
+    bits = 8 * struct.calcsize('<' + code)
+    if code in 'bhilq':
+        return rand.randint(-(1 << (bits-1)), (1 << (bits-1)) - 1)
+    return rand.randint(0, (1 << bits) - 1)
+
+def random_fields(fmt, names):
+    '''return a dictionary of random values for the fields of a format'''
+    (order, codes) = ublox.FormatParse(fmt)
+    ret = {}
+    i = 0
+    for f in names:
+        (fieldname, alen) = ublox.ArrayParse(f)
+        if alen == -1:
+            ret[fieldname] = random_value(codes[i])
+            i += 1
+        else:
+            ret[fieldname] = [random_value(codes[i+a]) for a in range(alen)]
+            i += alen
+    return ret
+
+def make_frame(msg_type, fields={}, nrecs=0, recs=[]):
+    '''build a valid frame of a known message type with random field values,
+    overridden by fields, and nrecs repeated records overridden by recs'''
+    desc = ublox.msg_types[msg_type]
+    msg = ublox.UBloxMessage()
+    msg._fields = random_fields(desc.msg_format.replace(',', ''), desc.fields)
+    msg._fields.update(fields)
+    if desc.format2 is not None:
+        if desc.count_field not in [None, '_remaining']:
+            msg._fields[desc.count_field] = nrecs
+        for i in range(nrecs):
+            r = random_fields(desc.format2, desc.fields2)
+            if i < len(recs):
+                r.update(recs[i])
+            msg._recs.append(r)
+    desc.pack(msg, msg_type[0], msg_type[1])
+    return msg._buf
+
+def epoch_frames(itow, week, svs, second_start):
+    '''return the frames of one navigation epoch'''
+    t = {'iTOW' : itow}
+    frames = [
+        make_frame((ublox.CLASS_RXM, ublox.MSG_RXM_RAW), {'iTOW' : itow, 'week' : week}, len(svs),
+                   [{'sv' : sv, 'mesQI' : 7} for sv in svs]),
+        make_frame((ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF), t),
+        make_frame((ublox.CLASS_NAV, ublox.MSG_NAV_POSLLH), t),
+        make_frame((ublox.CLASS_NAV, ublox.MSG_NAV_VELNED), t),
+        make_frame((ublox.CLASS_NAV, ublox.MSG_NAV_SOL), {'iTOW' : itow, 'week' : week, 'numSV' : len(svs)}),
+        make_frame((ublox.CLASS_NAV, ublox.MSG_NAV_SVINFO), t, len(svs),
+                   [{'svid' : sv} for sv in svs]),
+        ]
+    if second_start:
+        for sv in svs[:2]:
+            frames.append(make_frame((ublox.CLASS_RXM, ublox.MSG_RXM_SFRB), {'svid' : sv}))
+        if opts.all_types:
+            for msg_type in sorted(ublox.msg_types.keys()):
+                frames.append(make_frame(msg_type, t, 2))
+    return frames
+
+def corrupt(frame):
+    '''apply the requested corruption to a frame'''
+    if opts.garbage > 0 and rand.random() < opts.garbage:
+        frame = ''.join([chr(rand.randint(0, 255)) for i in range(rand.randint(1, 32))]) + frame
+    if opts.corrupt > 0 and rand.random() < opts.corrupt:
+        i = rand.randint(0, len(frame)-1)
+        frame = frame[:i] + chr(ord(frame[i]) ^ (1 << rand.randint(0, 7))) + frame[i+1:]
+    if opts.truncate > 0 and rand.random() < opts.truncate:
+        frame = frame[:rand.randint(1, len(frame)-1)]
+    return frame
+
+def generate():
+    '''generate the synthetic stream'''
+    week = 1800
+    itow = 100000000
+    svs = sorted(rand.sample(range(1, 33), opts.sats))
+    frames = []
+    for e in range(opts.seconds * opts.rate):
+        for f in epoch_frames(itow, week, svs, e % opts.rate == 0):
+            frames.append(corrupt(f))
+        itow += 1000 // opts.rate
+    return ''.join(frames)
+
+def alloc_start():
+    '''start measuring memory allocation'''
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def alloc_end(rss):
+    '''finish measuring memory allocation, returning a description. Without
+    tracemalloc (python 2) this is the growth of the peak RSS, which only
+    means something for the one benchmark a process runs'''
+    if tracemalloc is None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+        return 'peak RSS +%u KiB' % rss
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return 'peak %u KiB' % (peak // 1024)
+
+def measure(fn):
+    '''run a benchmark, returning the frame count, time and allocation'''
+    rss = alloc_start()
+    t0 = time.time()
+    count = fn()
+    dt = time.time() - t0
+    return (count, dt, alloc_end(rss))
+
+def run(name, fn, nbytes):
+    '''run one benchmark and print its throughput. Without tracemalloc each
+    benchmark runs in a child process, which starts with a peak RSS of the
+    memory in use when it forks, so the peak RSS growth is its own'''
+    if tracemalloc is None and hasattr(os, 'fork'):
+        (rfd, wfd) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            os.write(wfd, repr(measure(fn)))
+            os._exit(0)
+        os.close(wfd)
+        result = ''
+        while True:
+            s = os.read(rfd, 4096)
+            if not s:
+                break
+            result += s
+        os.close(rfd)
+        (pid, status) = os.waitpid(pid, 0)
+        if status != 0 or not result:
+            raise ublox.UBloxError('benchmark %s failed' % name)
+        (count, dt, alloc) = eval(result)
+    else:
+        (count, dt, alloc) = measure(fn)
+    print("%-12s %8u frames %8.3fs %10.0f frames/s %7.2f MB/s  %s" % (
+        name, count, dt, count / dt, nbytes / dt / 1.0e6, alloc))
+
+def bench_add():
+    '''frame with UBloxMessage.add(), as receive_message() used to'''
+    msg = ublox.UBloxMessage()
+    pos = 0
+    count = 0
+    while pos < len(stream):
+        n = msg.needed_bytes()
+        msg.add(stream[pos:pos+n])
+        pos += n
+        if msg.valid():
+            count += 1
+            msg = ublox.UBloxMessage()
+    return count
+
+def bench_framer():
+    '''frame with UBloxFramer in 4 KiB reads'''
+    framer = ublox.UBloxFramer()
+    count = 0
+    for pos in range(0, len(stream), 4096):
+        framer.add(stream[pos:pos+4096])
+        for frame in framer:
+            count += 1
+    return count
+
+def bench_receive():
+    '''frame and create messages with UBlox.receive_message() from a file'''
+    dev = ublox.UBlox(opts.save)
+    count = 0
+    while True:
+        try:
+            msg = dev.receive_message()
+        except ublox.UBloxError:
+            continue
+        if msg is None:
+            break
+        count += 1
+    dev.close()
+    return count
+
+def bench_unpack():
+    '''fully unpack every message'''
+    for msg in messages:
+        msg._unpacked = False
+        msg._lazy = False
+        msg.unpack()
+    return len(messages)
+
+def bench_unpack_lazy():
+    '''lazily unpack every message and read one field'''
+    for msg in messages:
+        msg._unpacked = False
+        msg._lazy = False
+        msg._fields = {}
+        msg.unpack(lazy=True)
+        msg.have_field('iTOW')
+    return len(messages)
+
+def bench_pack():
+    '''pack every message'''
+    for msg in messages:
+        msg.pack()
+    return len(messages)
+
+def bench_format():
+    '''format every message as a string'''
+    for msg in messages:
+        str(msg)
+    return len(messages)
+
+t0 = time.time()
+stream = generate()
+print("generated %u bytes in %.1fs" % (len(stream), time.time() - t0))
+# the receive benchmark reads the stream from a file
+if opts.save is None:
+    (fd, opts.save) = tempfile.mkstemp(suffix='.ubx')
+    os.close(fd)
+    atexit.register(os.unlink, opts.save)
+open(opts.save, mode='wb').write(stream)
+
+# the messages used by the decode benchmarks
+messages = []
+framer = ublox.UBloxFramer()
+framer.add(stream)
+for frame in framer:
+    msg = ublox.UBloxMessage()
+    msg._buf = frame.tobytes()
+    if msg.msg_type() in ublox.msg_types:
+        msg.unpack()
+        messages.append(msg)
+msg_bytes = sum([len(m._buf) for m in messages])
+
+tests = {
+    'add'         : (bench_add, len(stream)),
+    'framer'      : (bench_framer, len(stream)),
+    'receive'     : (bench_receive, len(stream)),
+    'unpack'      : (bench_unpack, msg_bytes),
+    'unpack_lazy' : (bench_unpack_lazy, msg_bytes),
+    'pack'        : (bench_pack, msg_bytes),
+    'format'      : (bench_format, msg_bytes),
+    }
+
+for name in opts.tests.split(','):
+    (fn, nbytes) = tests[name]
+    run(name, fn, nbytes)
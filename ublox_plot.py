@@ -10,6 +10,7 @@ from optparse import OptionParser
 
 parser = OptionParser("ublox_plot.py [options] <file>")
 parser.add_option("--seek", type='float', default=0, help="seek percentage to start in log")
+parser.add_option("--seek-time", default=None, help="GPS time to start in log, as week,tow or tow in seconds")
 parser.add_option("-f", "--follow", action='store_true', default=False, help="ignore EOF")
 parser.add_option("--size", type='int', default=20, help="plot size in meters")
 parser.add_option("--skip", type='int', default=1, help="show every N positions")
@@ -34,7 +35,11 @@ devs = []
 for d in args:
     devs.append(ublox.UBlox(d))
 
-if opts.seek != 0:
+if opts.seek_time is not None:
+    (week, tow) = util.ParseGPSTime(opts.seek_time)
+    for d in devs:
+        d.seek_time(week, tow)
+elif opts.seek != 0:
     for d in devs:
         d.seek_percent(opts.seek)
 
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import ublox, sys, fnmatch, os, time
+import ublox, sys, fnmatch, os, time, hashlib
 import util, satelliteData, positionEstimate
 import numpy
 
@@ -12,6 +12,7 @@ from optparse import OptionParser
 
 parser = OptionParser("ublox_pr_plot.py [options] <file>")
 parser.add_option("--seek", type='float', default=0, help="seek percentage to start in log")
+parser.add_option("--seek-time", default=None, help="GPS time to start in log, as week,tow or tow in seconds")
 parser.add_option("-f", "--follow", action='store_true', default=False, help="ignore EOF")
 parser.add_option("--reference", help="reference position (lat,lon,alt)", default=None)
 parser.add_option("--sats", type='int', help="Satellite to plot")
@@ -21,73 +22,91 @@ parser.add_option("--sats", type='int', help="Satellite to plot")
 if opts.reference:
     reference_position = util.ParseLLH(opts.reference)
 
-dev = ublox.UBlox(args[0])
-
-if opts.seek != 0:
-    for d in devs:
-        d.seek_percent(opts.seek)
+index = ublox.UBloxLogIndex(args[0])
 
 sat = opts.sats
 
-geo = {}
-pr = {}
-sm = {}
-cr = {}
-qi = {}
-slip = {}
-
-# Here on mostly coded to support multiple sats
-sats = [sat]
-
-for sv in sats:
-    geo[sv] = []
-    pr[sv] = []
-    sm[sv] = []
-    cr[sv] = []
-    qi[sv] = []
-    slip[sv] = []
-
-satinfo = satelliteData.SatelliteData()
-satinfo.reference_position = util.ParseLLH(opts.reference).ToECEF()
-
-satinfo.min_elevation = 0
-satinfo.min_quality = 0
-
-while True:
-    msg = dev.receive_message(ignore_eof=False)
-
-    if msg is None:
-        break
+def process_log():
+    '''run the log through the position estimator, returning the ranges
+    of the plotted satellite'''
+    geo = {}
+    pr = {}
+    sm = {}
+    cr = {}
+    qi = {}
+    slip = {}
+
+    # Here on mostly coded to support multiple sats
+    sats = [sat]
+
+    for sv in sats:
+        geo[sv] = []
+        pr[sv] = []
+        sm[sv] = []
+        cr[sv] = []
+        qi[sv] = []
+        slip[sv] = []
+
+    satinfo.reference_position = util.ParseLLH(opts.reference).ToECEF()
+
+    satinfo.min_elevation = 0
+    satinfo.min_quality = 0
+
+    types = [(ublox.CLASS_RXM, ublox.MSG_RXM_RAW),
+             (ublox.CLASS_RXM, ublox.MSG_RXM_SFRB),
+             (ublox.CLASS_AID, ublox.MSG_AID_EPH)]
+
+    if opts.seek_time is not None:
+        start = index.find_time(*util.ParseGPSTime(opts.seek_time))
+    else:
+        start = opts.seek*0.01*index.size
 
-    if msg.name() in ['RXM_RAW', 'RXM_SFRB', 'AID_EPH']:
+    for msg in index.messages(types, start=start):
         msg.unpack()
         satinfo.add_message(msg)
-    else:
-        continue
 
-    if msg.name() == 'RXM_RAW':
-        positionEstimate.positionEstimate(satinfo)
+        if msg.name() == 'RXM_RAW':
+            positionEstimate.positionEstimate(satinfo)
+
+            for r in msg.recs:
+                if r.sv not in sats:
+                    continue
+
+                if not satinfo.valid(r.sv):
+                    continue
 
-        for r in msg.recs:
-            if r.sv not in sats:
-                continue
+                geo[r.sv].append(satinfo.reference_position.distance(satinfo.satpos[r.sv]))
+                pr[r.sv].append(satinfo.prMeasured[r.sv] + util.speedOfLight*satinfo.receiver_clock_error)
+                sm[r.sv].append(satinfo.prSmoothed[r.sv] + util.speedOfLight*satinfo.receiver_clock_error)
+                cr[r.sv].append(satinfo.prCorrected[r.sv] + util.speedOfLight * satinfo.receiver_clock_error)
+                qi[r.sv].append(r.mesQI)
 
-            if not satinfo.valid(r.sv):
-                continue
+                slip[r.sv].append(1 if satinfo.smooth.N[r.sv] == 1 else 0)
 
-            geo[r.sv].append(satinfo.reference_position.distance(satinfo.satpos[r.sv]))
-            pr[r.sv].append(satinfo.prMeasured[r.sv] + util.speedOfLight*satinfo.receiver_clock_error)
-            sm[r.sv].append(satinfo.prSmoothed[r.sv] + util.speedOfLight*satinfo.receiver_clock_error)
-            cr[r.sv].append(satinfo.prCorrected[r.sv] + util.speedOfLight * satinfo.receiver_clock_error)
-            qi[r.sv].append(r.mesQI)
+    return {'geo' : numpy.array(geo[sat]), 'pr' : numpy.array(pr[sat]),
+            'sm' : numpy.array(sm[sat]), 'cr' : numpy.array(cr[sat]),
+            'qi' : numpy.array(qi[sat]), 'slip' : numpy.array(slip[sat]),
+            'svs' : numpy.array(satinfo.satpos.keys())}
 
-            slip[r.sv].append(1 if satinfo.smooth.N[r.sv] == 1 else 0)
+# the ranges depend on the options and on the ephemerides SatelliteData
+# loads from the working directory as well as the log. The journal is only
+# read, so processing the log doesn't change the cache key
+satinfo = satelliteData.SatelliteData(read_only=True)
+key = hashlib.md5(repr((sat, opts.reference, opts.seek, opts.seek_time))).hexdigest()
+sources = [args[0]] + [f for f in [satelliteData.JOURNAL_FILE] if os.path.exists(f)]
+ranges = util.cachedArrays(sources, 'pr_plot-' + key, process_log)
 
+geo = { sat : ranges['geo'].tolist() }
+pr = { sat : ranges['pr'].tolist() }
+sm = { sat : ranges['sm'].tolist() }
+cr = { sat : ranges['cr'].tolist() }
+qi = { sat : ranges['qi'].tolist() }
+slip = { sat : ranges['slip'].tolist() }
 
 smdelta = numpy.array(pr[sat]) - numpy.array(sm[sat])
 res = numpy.array(geo[sat]) - numpy.array(cr[sat])
 
-print(satinfo.satpos.keys())
+print(ranges['svs'].tolist())
 
 host = host_subplot(111, axes_class=AA.Axes)
 plt.subplots_adjust(right=0.75)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+'''
+replay a UBX log over TCP or a pseudo-terminal, paced by the iTOW of the messages
+'''
+
+import ublox, util, sys, os, time, socket, select, errno
+
+from optparse import OptionParser
+
+parser = OptionParser("ublox_replay.py [options] <file>")
+parser.add_option("--port", type='int', default=2300, help="TCP port to serve on")
+parser.add_option("--bind", default='127.0.0.1', help="address to serve on")
+parser.add_option("--pty", action='store_true', default=False, help="serve on a pseudo-terminal instead of TCP")
+parser.add_option("--speed", type='float', default=1.0, help="replay speed, 0 for as fast as possible")
+parser.add_option("--wait", action='store_true', default=False, help="wait for a client before starting")
+parser.add_option("--loop", action='store_true', default=False, help="restart at the end of the log")
+parser.add_option("--seek-time", default=None, help="GPS time to start in log, as week,tow or tow in seconds")
+parser.add_option("--max-backlog", type='int', default=1<<20, help="drop clients with more than this many bytes unsent")
+parser.add_option("--stall-time", type='float', default=1.0, help="seconds without a write before a client no longer paces a replay at speed 0")
+
+(opts, args) = parser.parse_args()
+
+if len(args) != 1:
+    parser.print_help()
+    sys.exit(1)
+
+index = ublox.UBloxLogIndex(args[0])
+start = 0
+if opts.seek_time is not None:
+    start = index.find_time(*util.ParseGPSTime(opts.seek_time))
+frames = index.select(None, start)
+
+class Client:
+    '''a connected client with its queue of unsent data'''
+    def __init__(self, fd, name, sock=None):
+        self.fd = fd
+        self.name = name
+        self.sock = sock
+        self.backlog = ''
+        # when data was last written to the client
+        self.progress = time.time()
+
+    def send(self, data):
+        '''queue data and write as much as the client accepts'''
+        self.backlog += data
+        self.flush()
+
+    def flush(self):
+        '''write as much queued data as the client accepts'''
+        if not self.backlog:
+            return
+        try:
+            if self.sock is not None:
+                n = self.sock.send(self.backlog)
+            else:
+                n = os.write(self.fd, self.backlog)
+        except (socket.error, OSError) as e:
+            if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                return
+            raise
+        self.backlog = self.backlog[n:]
+        if n > 0:
+            self.progress = time.time()
+
+    def stalled(self):
+        '''return true if the client has data queued but has taken none of
+        it for the stall time'''
+        return len(self.backlog) > 0 and time.time() - self.progress > opts.stall_time
+
+    def close(self):
+        '''close the connection'''
+        if self.sock is not None:
+            self.sock.close()
+        else:
+            os.close(self.fd)
+
+clients = []
+listener = None
+
+if opts.pty:
+    import pty, tty, fcntl
+    (master, slave) = pty.openpty()
+    tty.setraw(slave)
+    fcntl.fcntl(master, fcntl.F_SETFL, fcntl.fcntl(master, fcntl.F_GETFL) | os.O_NONBLOCK)
+    print("Serving %s on %s" % (args[0], os.ttyname(slave)))
+    clients.append(Client(master, os.ttyname(slave)))
+else:
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((opts.bind, opts.port))
+    listener.listen(5)
+    print("Serving %s on tcp:%s:%u" % (args[0], opts.bind, opts.port))
+sys.stdout.flush()
+
+def service(timeout):
+    '''accept new clients and write queued data for up to timeout seconds'''
+    deadline = time.time() + timeout
+    while True:
+        rlist = []
+        if listener is not None:
+            rlist.append(listener)
+        wlist = [c.fd for c in clients if c.backlog]
+        (r, w, x) = select.select(rlist, wlist, [], max(0, deadline - time.time()))
+        if listener in r:
+            (sock, addr) = listener.accept()
+            sock.setblocking(0)
+            sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+            clients.append(Client(sock.fileno(), '%s:%u' % addr, sock))
+            print("Client %s connected" % clients[-1].name)
+            sys.stdout.flush()
+        for c in clients[:]:
+            if c.fd in w:
+                try:
+                    c.flush()
+                except (socket.error, OSError) as e:
+                    drop(c, e)
+        if time.time() >= deadline:
+            return
+
+def drop(c, reason):
+    '''disconnect a client'''
+    print("Client %s dropped: %s" % (c.name, reason))
+    sys.stdout.flush()
+    c.close()
+    clients.remove(c)
+
+def broadcast(data):
+    '''send data to every client, dropping clients which fall too far
+    behind. At speed 0 this waits until a client which is still taking data
+    has room for more, so the replay goes as fast as the fastest client
+    and a stalled client, or a pty nothing reads, holds up nobody'''
+    for c in clients[:]:
+        try:
+            c.send(data)
+        except (socket.error, OSError) as e:
+            drop(c, e)
+            continue
+        if len(c.backlog) > opts.max_backlog:
+            if c.sock is None:
+                # nothing may be reading the pty, keep it open and skip
+                # the data it missed
+                c.backlog = ''
+            else:
+                drop(c, 'too far behind')
+    if opts.speed == 0:
+        while True:
+            active = [c for c in clients if not c.stalled()]
+            if not active or [c for c in active if len(c.backlog) <= 65536]:
+                break
+            service(0.01)
+
+while True:
+    if opts.wait:
+        while not clients:
+            service(0.5)
+
+    t_start = time.time()
+    log_start = None
+    week_ofs = 0
+    last_itow = None
+    count = 0
+    for i in frames.tolist():
+        itow = int(index.itow[i])
+        if itow >= 0 and opts.speed > 0:
+            if last_itow is not None and itow < last_itow - 302400000:
+                # crossed the end of a GPS week
+                week_ofs += 604800000
+            last_itow = itow
+            t = itow + week_ofs
+            if log_start is None:
+                log_start = t
+            due = t_start + (t - log_start) * 0.001 / opts.speed
+            now = time.time()
+            if due > now:
+                service(due - now)
+        broadcast(index.frame(i))
+        count += 1
+        if count % 1000 == 0:
+            service(0)
+    print("Sent %u messages in %.1fs" % (count, time.time() - t_start))
+    sys.stdout.flush()
+    if not opts.loop:
+        break
+
+# give clients a few seconds to drain their backlog before closing
+deadline = time.time() + 5
+while [c for c in clients if c.backlog] and time.time() < deadline:
+    service(0.1)
+for c in clients[:]:
+    c.close()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import ublox, sys, fnmatch, os
+import ublox, sys, os
 
 from optparse import OptionParser
 
@@ -10,6 +10,7 @@ parser.add_option("--seek", type='float', default=0, help="seek percentage to st
 parser.add_option("--baudrate", type='int',
                   help="serial baud rate", default=115200)
 parser.add_option("-f", "--follow", action='store_true', default=False, help="ignore EOF")
+parser.add_option("--stats", action='store_true', default=False, help="show parser statistics at the end")
 
 (opts, args) = parser.parse_args()
 
@@ -27,27 +28,27 @@ dev.configure_solution_rate(rate_ms=200)
 if opts.seek != 0:
     dev.seek_percent(opts.seek)
 
-types = opts.types.split(',')
+types = None
+if opts.types != '*':
+    types = ublox.message_types(opts.types.split(','))
 
 while True:
-    msg = dev.receive_message(ignore_eof=opts.follow)
+    msg = dev.receive_message(ignore_eof=opts.follow, types=types)
     if msg is None:
         break
-    if types != ['*']:
-        matched = False
-        try:
-            name = msg.name()
-        except ublox.UBloxError as e:
-            continue
-        for t in types:
-            if fnmatch.fnmatch(name, t):
-                matched = True
-                break
-        if not matched:
-            continue
     try:
         print(str(msg))
     except ublox.UBloxError as e:
         print e.message
     sys.stdout.flush()
 
+if opts.stats:
+    stats = dev.stats()
+    for (type, count) in sorted(stats.pop('frames').items()):
+        if type in ublox.msg_types:
+            name = ublox.msg_types[type].name
+        else:
+            name = str(type)
+        print("%s: %u" % (name, count))
+    for k in sorted(stats.keys()):
+        print("%s: %s" % (k, stats[k]))
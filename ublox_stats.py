@@ -118,11 +118,7 @@ def pairwise_stats(p1, p2):
 
 devs = []
 for d in args:
-    devs.append((ublox.UBlox(d),d))
-
-if opts.seek != 0:
-    for d, name in devs:
-        d.seek_percent(opts.seek)
+    devs.append((ublox.UBloxLogIndex(d),d))
 
 last_t = time.time()
 
@@ -132,14 +128,9 @@ for i in range(len(devs)):
     pos[i] = []
 
 for i, (d, name) in enumerate(devs):
-    while True:
-        msg = d.receive_message()
-        if msg is None:
-            break
-
-        if msg.name() == 'NAV_POSECEF':
-            msg.unpack()
-            pos[i].append(numpy.array([msg.ecefX / 100., msg.ecefY / 100., msg.ecefZ / 100.]))
+    start = opts.seek*0.01*d.size
+    t = d.cached_table(ublox.CLASS_NAV, ublox.MSG_NAV_POSECEF, start=start)
+    pos[i] = numpy.column_stack((t['ecefX'], t['ecefY'], t['ecefZ'])) / 100.
 
 for i in pos:
     print(devs[i][1])
@@ -13,6 +13,30 @@ parser.add_option("--show", action='store_true', default=False, help='show messa
 
 (opts, args) = parser.parse_args()
 
+def test_checksum():
+    '''check the checksum of a frame with the longest possible payload
+    against a plain byte loop'''
+    import random, struct
+    rand = random.Random(1)
+    payload = ''.join([chr(rand.randint(0, 255)) for i in range(0xFFFF)])
+    buf = struct.pack('<BBBBH', ublox.PREAMBLE1, ublox.PREAMBLE2, 0x7f, 0x01, len(payload)) + payload
+    ck_a = 0
+    ck_b = 0
+    for b in bytearray(buf[2:]):
+        ck_a = (ck_a + b) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    if ublox.ubx_checksum(buf, 2) != (ck_a, ck_b):
+        print("checksum of maximum length frame failed")
+        return False
+    buf += struct.pack('<BB', ck_a, ck_b)
+    if not ublox.ubx_verify_frames(buf, [0]).all():
+        print("batch checksum of maximum length frame failed")
+        return False
+    print("checksum OK")
+    return True
+
+test_checksum()
+
 for f in args:
     print('Testing %s' % f)
     dev = ublox.UBlox(f)
@@ -215,6 +215,16 @@ def ParseLLH(pos_string):
         return None
     return PosLLH(float(a[0]), float(a[1]), float(a[2]))
 
+def ParseGPSTime(time_string):
+    '''parse a week,tow or tow string, returning (week, tow) with week None
+    if it was not given'''
+    a = time_string.split(',')
+    if len(a) == 1:
+        return (None, float(a[0]))
+    if len(a) != 2:
+        raise ValueError("bad GPS time %s" % time_string)
+    return (int(a[0]), float(a[1]))
+
 def correctWeeklyTime(time):
     '''correct the time accounting for beginning or end of week crossover'''
     half_week       = 302400 # seconds
@@ -250,3 +260,161 @@ def loadObject(filename):
 	return obj
     except Exception as e:
         return None
+
+def cachedArrays(sources, name, build):
+    '''return a dictionary of numpy arrays computed by build() from the
+    files named in sources. The arrays are cached in <source>.<name>.npz
+    next to the first source, and reused while the paths, sizes and mtimes
+    of all the sources are unchanged'''
+    import numpy, zipfile
+    key = repr([(os.path.abspath(s), os.path.getsize(s), os.path.getmtime(s)) for s in sources])
+    cachefile = sources[0] + '.' + name + '.npz'
+    try:
+        npz = numpy.load(cachefile)
+        try:
+            if str(npz['_key']) == key:
+                return dict([(k, npz[k]) for k in npz.files if k != '_key'])
+        finally:
+            npz.close()
+    except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile):
+        pass
+    ret = build()
+    try:
+        h = open(cachefile + '.tmp', mode='wb')
+        numpy.savez(h, _key=numpy.array(key), **ret)
+        h.close()
+        os.rename(cachefile + '.tmp', cachefile)
+    except (IOError, OSError):
+        pass
+    return ret
+
+class WordJournal:
+    '''append-only journal of fixed size records of 32 bit words, which
+    several processes sharing a directory can use at once.
+
+    Each record holds a non-zero kind, an svid, up to nwords words and a
+    CRC32, so a record torn by a crash is ignored on load. Appends and
+    compaction hold an flock() on <filename>.lock. Compaction writes a
+    new file and renames it over the journal, so the journal is opened
+    for each append rather than kept open.
+    '''
+    magic = 'UBXJ'
+
+    # the number of newest records whose CRC is checked on every load
+    tail_check = 8
+
+    def __init__(self, filename, nwords=25):
+        import struct
+        self.filename = filename
+        self.nwords = nwords
+        self.header = struct.pack('<4sI', self.magic, nwords)
+        self.record = struct.Struct('<BBH%uI' % nwords)
+        self.record_size = self.record.size + 4
+
+    def _lock(self):
+        '''take the journal lock, returning the lock file'''
+        import fcntl
+        lock = open(self.filename + '.lock', mode='a')
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        return lock
+
+    def _pack(self, kind, svid, words):
+        '''return a record as a string'''
+        import struct, zlib
+        if kind == 0:
+            raise ValueError("journal record kind must be non-zero")
+        words = list(words) + [0] * (self.nwords - len(words))
+        r = self.record.pack(kind, svid, 0, *words)
+        return r + struct.pack('<I', zlib.crc32(r) & 0xFFFFFFFF)
+
+    def append(self, kind, svid, words):
+        '''append a record'''
+        r = self._pack(kind, svid, words)
+        lock = self._lock()
+        try:
+            fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                if size < len(self.header):
+                    os.ftruncate(fd, 0)
+                    r = self.header + r
+                elif (size - len(self.header)) % self.record_size != 0:
+                    # drop a record torn by a crash, so later ones stay aligned
+                    os.ftruncate(fd, size - (size - len(self.header)) % self.record_size)
+                os.write(fd, r)
+            finally:
+                os.close(fd)
+        finally:
+            lock.close()
+
+    def _load(self):
+        '''return (kinds, svids, words) arrays of the valid records.
+
+        Appends only ever tear the newest records, and the next append
+        truncates a torn record, so the kind and reserved fields of all
+        records are checked as arrays but only the newest tail_check
+        records have their CRC computed. If the file is not a whole
+        number of records, or any record fails those checks, the
+        journal was left by a crash and every record's CRC is checked'''
+        import mmap, numpy, zlib
+        dtype = numpy.dtype([('kind', '<u1'), ('svid', '<u1'), ('reserved', '<u2'),
+                             ('words', '<u4', (self.nwords,)), ('crc', '<u4')])
+        empty = (numpy.zeros(0, dtype=numpy.uint8), numpy.zeros(0, dtype=numpy.uint8),
+                 numpy.zeros((0, self.nwords), dtype=numpy.uint32))
+        try:
+            f = open(self.filename, mode='rb')
+        except IOError:
+            return empty
+        try:
+            size = os.fstat(f.fileno()).st_size
+            count = (size - len(self.header)) // self.record_size
+            if count <= 0:
+                return empty
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if data[:len(self.header)] != self.header:
+                    return empty
+                recs = numpy.frombuffer(data, dtype=dtype, count=count, offset=len(self.header))
+                ok = (recs['kind'] != 0) & (recs['reserved'] == 0)
+                check = numpy.arange(count)
+                if ok.all() and (size - len(self.header)) % self.record_size == 0:
+                    check = check[-self.tail_check:]
+                rsize = self.record.size
+                crcs = numpy.array([zlib.crc32(data[o:o+rsize]) & 0xFFFFFFFF
+                                    for o in (len(self.header) + check * self.record_size).tolist()],
+                                   dtype=numpy.uint32)
+                ok[check] = ok[check] & (crcs == recs['crc'][check])
+                ret = (recs['kind'][ok].copy(), recs['svid'][ok].copy(), recs['words'][ok].copy())
+                del recs
+                return ret
+            finally:
+                data.close()
+        finally:
+            f.close()
+
+    def load(self):
+        '''return (kinds, svids, words) numpy arrays of the records, with
+        one row of words per record. This needs no lock, as compaction
+        replaces the file whole and a partly appended record fails its
+        CRC check'''
+        return self._load()
+
+    def __len__(self):
+        try:
+            return max(0, (os.path.getsize(self.filename) - len(self.header)) // self.record_size)
+        except OSError:
+            return 0
+
+    def compact(self, build):
+        '''rewrite the journal with the records returned by
+        build(kinds, svids, words), given the current records as for
+        load(). build() should return a list of (kind, svid, words)'''
+        lock = self._lock()
+        try:
+            records = build(*self._load())
+            h = open(self.filename + '.tmp', mode='wb')
+            h.write(self.header + ''.join([self._pack(*r) for r in records]))
+            h.close()
+            os.rename(self.filename + '.tmp', self.filename)
+        finally:
+            lock.close()